@@ -1,9 +1,13 @@
+import argparse
 import json
-from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 import os
+from gaby.embeddings import DEFAULT_MODELS, get_embeddings, parse_embedding_config
+from gaby.ingest import manifest_path, sync_store
+from gaby.lexical import build_lexical_index, lexical_index_path
+from gaby.records import iter_records, record_documents
+from gaby.vectors import VECTOR_DTYPES, dense_index_path, disk_size, export_dense_index
 
 def load_api_keys(filepath='credentials.json'):
     with open('credentials.json', 'r') as file:
@@ -13,20 +17,53 @@ def load_api_keys(filepath='credentials.json'):
             return credentials.get('key')
     return None
 
-api_keys = load_api_keys()
+parser = argparse.ArgumentParser()
+parser.add_argument('--full', action='store_true',
+                    help='ignore the manifest and re-embed every chunk')
+parser.add_argument('--embeddings', default='openai',
+                    help=f"embedding backend ({', '.join(DEFAULT_MODELS)}), "
+                         "optionally followed by :model")
+parser.add_argument('--batch-size', type=int, default=64,
+                    help='chunks sent per embedding request')
+parser.add_argument('--workers', type=int, default=4,
+                    help='embedding requests in flight at once')
+parser.add_argument('--vector-dtype', default='float32', choices=VECTOR_DTYPES,
+                    help='precision of the memory-mapped copy of the vectors')
+args = parser.parse_args()
 
-if api_keys:
-    os.environ['OPENAI_API_KEY'] = api_keys
+embedding_config = parse_embedding_config(args.embeddings)
 
-with open('gabysknowledge_final.txt', 'r') as file:
-  knowledgeText = file.read()
+if embedding_config['backend'] == 'openai':
+    api_keys = load_api_keys()
+    if api_keys:
+        os.environ['OPENAI_API_KEY'] = api_keys
 
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=500,
                                                chunk_overlap=20)
 
-documents = text_splitter.create_documents([knowledgeText])
+with open('gabysknowledge_final.txt', 'r', encoding='utf-8') as file:
+  documents = list(record_documents(iter_records(file), text_splitter))
 
-embeddings = OpenAIEmbeddings()
+embeddings = get_embeddings(embedding_config)
 
 store = Chroma("general_guides", embeddings, persist_directory='.chroma')
-store.add_documents(documents)
\ No newline at end of file
+
+def report(done, total, rate):
+    print(f"  {done}/{total} chunks embedded, {rate:.1f} chunks/s")
+
+stats = sync_store(store, embeddings, documents, "general_guides",
+                   manifest_path('.chroma'), embedding_config, full=args.full,
+                   batch_size=args.batch_size, workers=args.workers,
+                   progress=report)
+print(f"{len(documents)} chunks: {stats['added']} embedded, "
+      f"{stats['deleted']} deleted, {stats['unchanged']} unchanged "
+      f"in {stats['seconds']:.1f}s ({stats['chunks_per_second']:.1f} chunks/s)")
+
+# The BM25 side of hybrid retrieval, rebuilt in full since it takes seconds
+terms = build_lexical_index(documents, lexical_index_path('.chroma'), embedding_config)
+print(f"Lexical index: {terms} terms over {len(documents)} chunks")
+
+# The memory-mapped copy of the vectors the chatbot searches
+export_dense_index(store, dense_index_path('.chroma'), embedding_config, args.vector_dtype)
+size = disk_size(dense_index_path('.chroma'))
+print(f"Vector index: {len(documents)} x {args.vector_dtype} vectors, {size / 2**20:.1f} MiB on disk")
@@ -0,0 +1,106 @@
+# A/B comparison of the two answer modes on a fixed question set:
+#   rewrite      answer, then a second LLM call rewrites it for grammar
+#   single-pass  formatting rules in the answer prompt, deterministic cleanup
+#
+#   python -m benchmarks.answer_modes --backend phi3 --output answer_modes.json
+#
+# The backend's model, temperature and prompts are the ones the chat uses:
+# the registered defaults with the overrides of credentials.json (see
+# gaby/backends.py). Caches are not used, so both modes pay for retrieval
+# and generation.
+import argparse
+import json
+import os
+import statistics
+import time
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from gaby.backends import BACKENDS, api_keys, backend_settings, create_llm, load_credentials
+from gaby.chain import create_rag_chain
+from gaby.embeddings import load_vector_store
+from gaby.links import TitleLinker, enrich, grounded_links, load_links
+from gaby.postprocess import add_formatting_rules, postprocess
+
+
+def prompt_for(system_prompt):
+    return ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default='openai', choices=list(BACKENDS))
+    parser.add_argument('--questions', default='benchmarks/questions.txt')
+    parser.add_argument('--output', default='answer_modes.json')
+    args = parser.parse_args()
+
+    with open(args.questions, 'r', encoding='utf-8') as file:
+        questions = [line.strip() for line in file if line.strip()]
+
+    credentials = load_credentials()
+    settings = backend_settings(args.backend, credentials)
+    keys = api_keys(credentials)
+    if keys.get('openai'):
+        os.environ.setdefault('OPENAI_API_KEY', keys['openai'])
+    llm = create_llm(settings, keys)
+    retriever = load_vector_store().as_retriever()
+    linker = TitleLinker(load_links('titles_and_links.csv'))
+    rewrite = ChatPromptTemplate.from_messages([
+        ("system", settings['rewrite_prompt']),
+        ("user", "{input}"),
+    ]) | llm | StrOutputParser()
+    system_prompt = settings['system_prompt']
+    chains = {
+        'rewrite': create_rag_chain(llm, retriever, prompt_for(system_prompt)),
+        'single-pass': create_rag_chain(llm, retriever, prompt_for(add_formatting_rules(system_prompt))),
+    }
+
+    results = {mode: [] for mode in chains}
+    for question in questions:
+        for mode, chain in chains.items():
+            start = time.perf_counter()
+            response = chain.invoke({"input": question, "chat_history": []})
+            answer = enrich(response['answer'], linker, grounded_links(response['context']))
+            if mode == 'rewrite':
+                answer = rewrite.invoke({"input": answer})
+                if settings['cleanup']:
+                    answer = settings['cleanup'](answer)
+            else:
+                answer = postprocess(answer)
+            results[mode].append({
+                'question': question,
+                'seconds': time.perf_counter() - start,
+                'answer': answer,
+            })
+        print(f"{question[:50]:<50} " + "  ".join(
+            f"{mode} {results[mode][-1]['seconds']:.2f}s" for mode in chains))
+
+    summary = {}
+    for mode, runs in results.items():
+        seconds = [run['seconds'] for run in runs]
+        summary[mode] = {
+            'mean_seconds': statistics.mean(seconds),
+            'p50_seconds': percentile(seconds, 0.5),
+            'p95_seconds': percentile(seconds, 0.95),
+            'mean_answer_chars': statistics.mean(len(run['answer']) for run in runs),
+        }
+        print(f"{mode:<12} mean {summary[mode]['mean_seconds']:.2f}s  "
+              f"p50 {summary[mode]['p50_seconds']:.2f}s  p95 {summary[mode]['p95_seconds']:.2f}s")
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({'backend': args.backend, 'model': settings['model'], 'summary': summary, 'results': results}, file, indent=1)
+    print(f"answers written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
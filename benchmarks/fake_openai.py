@@ -0,0 +1,185 @@
+# A stand-in for the OpenAI embeddings and chat completions endpoints, so
+# ingestion and serving can be run and measured without network access or cost.
+#
+#   python -m benchmarks.fake_openai --port 8765 --rate-limit 0.1 --latency 0.05
+#   OPENAI_API_BASE=http://127.0.0.1:8765/v1 python 01_generate_embeddings.py
+#
+# Vectors are derived from a hash of the input, so the same text always gets
+# the same embedding. Chat completions answer with a fixed text of
+# --answer-tokens words, streamed one word every --token-latency seconds.
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(item, dimensions):
+    seed = hashlib.sha256(json.dumps(item).encode('utf-8')).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+ANSWER = (
+    "The library offers this service to all Concordia students and staff. You can find "
+    "more details in the Sofia Discovery tool or ask a librarian at the Webster or Vanier "
+    "library for help with your request."
+).split()
+
+
+def fake_answer(words):
+    return ' '.join(ANSWER[i % len(ANSWER)] for i in range(words))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    dimensions = 1536
+    latency = 0.0
+    rate_limit = 0.0
+    token_latency = 0.0
+    answer_tokens = 40
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self.stats['requests'] += 1
+        if self.path.rstrip('/').endswith('/embeddings'):
+            self.embeddings(request)
+        elif self.path.rstrip('/').endswith('/chat/completions'):
+            self.chat_completions(request)
+        else:
+            self._reply(404, {'error': {'message': f'no fake for {self.path}'}})
+
+    def _rate_limited(self):
+        if self.rate_limit and random.random() < self.rate_limit:
+            self.stats['rate_limited'] += 1
+            self._reply(429, {'error': {'message': 'Rate limit reached',
+                                        'type': 'requests', 'code': 'rate_limit_exceeded'}})
+            return True
+        return False
+
+    def embeddings(self, request):
+        if self._rate_limited():
+            return
+        time.sleep(self.latency)
+        inputs = request.get('input', [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for index, item in enumerate(inputs):
+            vector = fake_vector(item, self.dimensions)
+            if request.get('encoding_format') == 'base64':
+                vector = base64.b64encode(struct.pack(f'<{len(vector)}f', *vector)).decode('ascii')
+            data.append({'object': 'embedding', 'index': index, 'embedding': vector})
+        self.stats['embedded'] += len(inputs)
+        tokens = sum(len(item) if isinstance(item, list) else len(item) // 4 for item in inputs)
+        self._reply(200, {
+            'object': 'list',
+            'data': data,
+            'model': request.get('model', 'fake'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+
+    def chat_completions(self, request):
+        if self._rate_limited():
+            return
+        time.sleep(self.latency)
+        words = fake_answer(self.answer_tokens).split(' ')
+        prompt_tokens = sum(len(str(m.get('content', ''))) // 4 for m in request.get('messages', []))
+        base = {'id': 'chatcmpl-fake', 'created': int(time.time()),
+                'model': request.get('model', 'fake')}
+        self.stats['completions'] += 1
+        if not request.get('stream'):
+            time.sleep(self.token_latency * len(words))
+            self._reply(200, dict(base, object='chat.completion', choices=[{
+                'index': 0, 'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': ' '.join(words)},
+            }], usage={'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                       'total_tokens': prompt_tokens + len(words)}))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        def send(delta, finish_reason=None):
+            chunk = dict(base, object='chat.completion.chunk', choices=[{
+                'index': 0, 'delta': delta, 'finish_reason': finish_reason,
+            }])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send({'role': 'assistant', 'content': ''})
+            for i, word in enumerate(words):
+                time.sleep(self.token_latency)
+                send({'content': word if i == 0 else ' ' + word})
+            send({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the request
+            self.stats['disconnected'] += 1
+
+
+def serve(port=0, dimensions=1536, latency=0.0, rate_limit=0.0, token_latency=0.0,
+          answer_tokens=40):
+    handler = type('Handler', (FakeOpenAIHandler,), {
+        'dimensions': dimensions,
+        'latency': latency,
+        'rate_limit': rate_limit,
+        'token_latency': token_latency,
+        'answer_tokens': answer_tokens,
+        'stats': {'requests': 0, 'rate_limited': 0, 'embedded': 0,
+                  'completions': 0, 'disconnected': 0},
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every successful request')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='fraction of requests answered with a 429')
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        help='seconds between streamed answer words')
+    parser.add_argument('--answer-tokens', type=int, default=40,
+                        help='words in every chat completion')
+    args = parser.parse_args()
+    server = serve(args.port, args.dimensions, args.latency, args.rate_limit,
+                   args.token_latency, args.answer_tokens)
+    print(f"fake OpenAI API on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Import cost of the chat app, measured with python -X importtime in a fresh
+# interpreter per run, as a new pod or Streamlit server pays it.
+#
+#   python -m benchmarks.import_time --runs 5 --budget page=400 openai=2500
+#
+#   page     what a 02x script imports before its first render
+#   api      what python -m gaby.api imports before building the cores
+#   <name>   the core of one backend: gaby.core, Chroma and the LLM SDK
+#   eager    everything the 02x scripts used to import at the top
+#
+# The time reported is the sum of the module import times, without the
+# interpreter start; "wall" is the whole process. With --budget the command
+# fails when a scenario's median is over its budget in ms.
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from gaby.backends import BACKENDS
+
+SCENARIOS = {
+    'page': "import gaby.app",
+    'api': "import gaby.api",
+}
+BACKEND_SCENARIO = (
+    "from gaby.backends import backend_settings, create_llm\n"
+    "import gaby.core\n"
+    "from langchain_chroma import Chroma\n"
+    "create_llm(backend_settings({backend!r}), {{'google': 'fake'}})\n"
+)
+for name in BACKENDS:
+    SCENARIOS[name] = BACKEND_SCENARIO.format(backend=name)
+# Modules that are not installed are left out
+SCENARIOS['eager'] = (
+    "import importlib\n"
+    "for module in ['streamlit', 'langchain.chains', 'langchain_chroma',\n"
+    "               'langchain_community.chat_message_histories', 'langchain_openai',\n"
+    "               'langchain_google_genai', 'google.generativeai', 'langchain_community.llms']:\n"
+    "    try:\n"
+    "        importlib.import_module(module)\n"
+    "    except ImportError:\n"
+    "        pass\n"
+)
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)')
+
+
+def measure(code):
+    # Returns (import ms, wall ms, self ms per top-level package) or the error
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'fake'))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             capture_output=True, text=True, env=env)
+    wall = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        return None, None, process.stderr.strip().splitlines()[-1]
+    packages = {}
+    for line in process.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            package = match.group(3).split('.')[0]
+            packages[package] = packages.get(package, 0) + int(match.group(1)) / 1000
+    return sum(packages.values()), wall, packages
+
+
+def parse_budgets(values):
+    budgets = {}
+    for value in values:
+        name, _, milliseconds = value.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        budgets[name] = float(milliseconds)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='heaviest packages to list')
+    parser.add_argument('--budget', nargs='*', default=[], metavar='SCENARIO=MS')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+    budgets = parse_budgets(args.budget)
+
+    results = {}
+    over = []
+    for name in args.scenarios:
+        runs = [measure(SCENARIOS[name]) for _ in range(args.runs)]
+        if runs[0][0] is None:
+            print(f"{name:>8}  skipped: {runs[0][2]}")
+            continue
+        imports = statistics.median(run[0] for run in runs)
+        wall = statistics.median(run[1] for run in runs)
+        heaviest = sorted(runs[-1][2].items(), key=lambda item: -item[1])[:args.top]
+        results[name] = {'import_ms': imports, 'wall_ms': wall,
+                         'heaviest': {package: ms for package, ms in heaviest}}
+        budget = budgets.get(name)
+        verdict = ''
+        if budget is not None:
+            results[name]['budget_ms'] = budget
+            verdict = f"  budget {budget:.0f} ms {'OK' if imports <= budget else 'OVER'}"
+            if imports > budget:
+                over.append(name)
+        print(f"{name:>8}  {imports:7.0f} ms imports  {wall:7.0f} ms wall{verdict}")
+        print(' ' * 10 + ', '.join(f"{package} {ms:.0f}" for package, ms in heaviest))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'runs': args.runs, 'python': sys.version.split()[0], 'scenarios': results},
+                      file, indent=1)
+        print(f"results written to {args.output}")
+    if over:
+        raise SystemExit(f"over the import budget: {', '.join(over)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Runs the ingestion pipeline of 01_generate_embeddings.py against the fake
+# embeddings server and a throwaway Chroma directory, for a few worker counts.
+#
+#   python -m benchmarks.ingest_throughput --workers 1 4 8 --latency 0.2 --rate-limit 0.05
+import argparse
+import os
+import shutil
+import tempfile
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import Chroma
+from langchain_openai import OpenAIEmbeddings
+
+from benchmarks.fake_openai import serve
+from gaby.ingest import manifest_path, sync_store
+from gaby.records import iter_records, record_documents
+
+
+def load_documents(limit):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
+    with open('gabysknowledge_final.txt', 'r', encoding='utf-8') as file:
+        documents = list(record_documents(iter_records(file), text_splitter))
+    return documents[:limit] if limit else documents
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--rate-limit', type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = serve(latency=args.latency, rate_limit=args.rate_limit)
+    embeddings = OpenAIEmbeddings(
+        openai_api_base=f'http://127.0.0.1:{server.server_port}/v1',
+        openai_api_key='fake',
+        max_retries=0,
+    )
+    print(f"fake server: {args.latency}s latency, {args.rate_limit:.0%} of requests rate limited")
+
+    for workers in args.workers:
+        directory = tempfile.mkdtemp(prefix='gaby-ingest-')
+        try:
+            persist_directory = os.path.join(directory, '.chroma')
+            store = Chroma('general_guides', embeddings, persist_directory=persist_directory)
+            stats = sync_store(store, embeddings, load_documents(args.limit), 'general_guides',
+                               manifest_path(persist_directory),
+                               {'backend': 'openai', 'model': 'fake'},
+                               batch_size=args.batch_size, workers=workers)
+            print(f"workers={workers:<3} batch={args.batch_size:<4} "
+                  f"{stats['added']} chunks in {stats['seconds']:.1f}s "
+                  f"= {stats['chunks_per_second']:.1f} chunks/s")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"server stats: {server.RequestHandlerClass.stats}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# Simulates concurrent chat sessions against the fake OpenAI server, through
+# the same chain and serving core as the chat apps, to find how many patrons
+# one process can serve.
+#
+#   python -m benchmarks.load_test --sessions 1 8 32 64 --max-concurrency 16
+#
+# Every session asks --questions questions in a row with --think-time seconds
+# between them. The fake LLM waits --latency seconds before the first word and
+# --token-latency seconds between words. Retrieval returns fixed chunks, so
+# the numbers only measure the serving path.
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.retrievers import BaseRetriever
+from langchain_openai import ChatOpenAI
+
+from benchmarks.answer_modes import percentile
+from benchmarks.fake_openai import serve
+from gaby.backends import backend_settings
+from gaby.chain import create_rag_chain
+from gaby.context import context_budget
+from gaby.serving import ServingCore
+
+
+class StaticRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+def build_chain(base_url):
+    # The registered OpenAI backend, pointed at the fake server
+    settings = backend_settings('openai')
+    llm = ChatOpenAI(model=settings['model'], temperature=settings['temperature'],
+                     base_url=base_url, api_key='fake', max_retries=0)
+    retriever = StaticRetriever(documents=[
+        Document(page_content=f"title: Guide {i}\nThe library guide number {i}.\n"
+                              f"link: https://library.concordia.ca/guide/{i}",
+                 metadata={'title': f"Guide {i}", 'link': f"https://library.concordia.ca/guide/{i}"})
+        for i in range(3)
+    ])
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", settings['system_prompt']),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ])
+    return create_rag_chain(llm, retriever, prompt,
+                            context_budget=context_budget(settings['model'], settings['system_prompt'],
+                                                          settings['prompt_budget']))
+
+
+async def session(core, chain, questions, think_time, results):
+    history = []
+    for number in range(questions):
+        question = f"Question {number}: how do I borrow a laptop?"
+        start = time.perf_counter()
+        first = None
+        answer = ''
+        try:
+            async for chunk in core.astream(chain, {"input": question, "chat_history": history}):
+                if chunk.get('answer'):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    answer += chunk['answer']
+        except TimeoutError:
+            results.append({'ok': False, 'seconds': time.perf_counter() - start})
+            continue
+        results.append({'ok': True, 'seconds': time.perf_counter() - start, 'first_token': first})
+        history += [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+        await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+
+async def run_level(chain, sessions, args):
+    core = ServingCore('openai', args.max_concurrency, args.timeout)
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(session(core, chain, args.questions, args.think_time, results)
+                           for _ in range(sessions)))
+    seconds = time.perf_counter() - start
+    ok = [r for r in results if r['ok']]
+    latencies = [r['seconds'] for r in ok] or [0.0]
+    first_tokens = [r['first_token'] for r in ok if r['first_token'] is not None] or [0.0]
+    return {
+        'sessions': sessions,
+        'requests': len(results),
+        'timeouts': len(results) - len(ok),
+        'requests_per_second': len(ok) / seconds,
+        'p50_seconds': percentile(latencies, 0.5),
+        'p95_seconds': percentile(latencies, 0.95),
+        'p95_first_token_seconds': percentile(first_tokens, 0.95),
+    }
+
+
+async def run_levels(chain, args):
+    # One event loop for every level, as the LLM client keeps its connections
+    levels = []
+    for sessions in args.sessions:
+        level = await run_level(chain, sessions, args)
+        levels.append(level)
+        print(f"{sessions:>4} sessions  {level['requests_per_second']:6.1f} req/s  "
+              f"p50 {level['p50_seconds']:.2f}s  p95 {level['p95_seconds']:.2f}s  "
+              f"p95 first token {level['p95_first_token_seconds']:.2f}s  "
+              f"{level['timeouts']} timeouts")
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--think-time', type=float, default=0.5)
+    parser.add_argument('--max-concurrency', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help='seconds before the first answer word')
+    parser.add_argument('--token-latency', type=float, default=0.02)
+    parser.add_argument('--answer-tokens', type=int, default=60)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    server = serve(latency=args.latency, token_latency=args.token_latency,
+                   answer_tokens=args.answer_tokens)
+    chain = build_chain(f'http://127.0.0.1:{server.server_port}/v1')
+    print(f"fake LLM: {args.latency}s to first word, {args.token_latency}s per word, "
+          f"{args.answer_tokens} words; at most {args.max_concurrency} requests in flight")
+
+    levels = asyncio.run(run_levels(chain, args))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'settings': vars(args), 'levels': levels}, file, indent=1)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Times a chat script the way Streamlit runs it: one cold start, then reruns
+# with the process-wide resources cached, then reruns with them cleared
+# before each one (which is what every rerun used to cost).
+#
+#   python -m benchmarks.rerun_timing 021_gaby_openai.py --reruns 10
+#
+# The page renders before its core (chain, index, clients) is built: that
+# happens in a background thread started by the page (see gaby/client.py).
+# So every run reports the render, and the time until the core is ready,
+# which is when the first question could be answered. "Cleared" drops both
+# Streamlit's cached resources and the cores in gaby.core.
+#
+# No question is submitted, so no LLM call is made; credentials.json and the
+# .chroma index must be present as for a normal run.
+import argparse
+import os
+import statistics
+import time
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from gaby import core
+
+
+def timed_run(app, backend):
+    start = time.perf_counter()
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    rendered = time.perf_counter()
+    # Waits for the core the page's preload thread is building
+    core.get_core(backend)
+    return (rendered - start) * 1000, (time.perf_counter() - start) * 1000
+
+
+def clear():
+    st.cache_resource.clear()
+    with core._cores_lock:
+        core._cores.clear()
+
+
+def report(name, runs):
+    print(f"  {name:<26}{statistics.median(run[0] for run in runs):8.1f} ms to render, "
+          f"{statistics.median(run[1] for run in runs):8.1f} ms to a ready core")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('script')
+    parser.add_argument('--backend', help='backend of the script, by default from its name')
+    parser.add_argument('--reruns', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+    backend = args.backend or os.path.splitext(os.path.basename(args.script))[0].split('_')[-1]
+
+    # Relative paths would be resolved against this file
+    app = AppTest.from_file(os.path.abspath(args.script), default_timeout=args.timeout)
+    startup = timed_run(app, backend)
+    cached = [timed_run(app, backend) for _ in range(args.reruns)]
+    cleared = []
+    for _ in range(args.reruns):
+        clear()
+        cleared.append(timed_run(app, backend))
+
+    print(f"{args.script} (medians of {args.reruns} reruns)")
+    report('cold start:', [startup])
+    report('rerun, resources cached:', cached)
+    report('rerun, resources rebuilt:', cleared)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# Retrieval quality and latency on the golden question set, and optionally
+# the latency of the full chain, so a change to chunking, the embedding
+# model or the retriever can be checked against the previous run.
+#
+#   python -m benchmarks.retrieval_eval --offline --chain --output retrieval_eval.json
+#   python -m benchmarks.retrieval_eval --persist-directory .chroma
+#   python -m benchmarks.retrieval_eval --offline --rerank mmr --chain
+#
+# benchmarks/golden/v<N>.jsonl maps real patron questions to the link: pages
+# of gabysknowledge_final.txt that answer them. A chunk is relevant when its
+# link is one of them; recall@k is the share of a question's links found in
+# the first k chunks, MRR uses the rank of the first relevant chunk.
+#
+# --offline builds a fresh index of the knowledge file in a temporary
+# directory, with --chunk-size/--chunk-overlap and the deterministic
+# "hashing" embeddings, and answers with the fake OpenAI server, so runs
+# need no network and give the same scores every time. Without it the index
+# in --persist-directory is measured with the embeddings it was built with.
+#
+# --rerank adds the hybrid candidates reordered by that reranker (see
+# gaby/rerank.py) to the retrievers, and turns it on for the --chain run.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.answer_modes import percentile
+from gaby.embeddings import get_embeddings, load_vector_store, parse_embedding_config
+from gaby.ingest import manifest_path, sync_store
+from gaby.lexical import HybridRetriever, build_lexical_index, lexical_index_path, load_lexical_index
+from gaby.records import iter_records, record_documents
+from gaby.rerank import RerankRetriever, create_reranker
+from gaby.vectors import dense_index_path, export_dense_index
+
+
+def load_golden(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def build_offline_index(directory, chunk_size, chunk_overlap, embedding_config):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    with open('gabysknowledge_final.txt', 'r', encoding='utf-8') as file:
+        documents = list(record_documents(iter_records(file), splitter))
+    from langchain_chroma import Chroma
+    embeddings = get_embeddings(embedding_config)
+    store = Chroma("general_guides", embeddings, persist_directory=directory)
+    sync_store(store, embeddings, documents, "general_guides", manifest_path(directory),
+               embedding_config, batch_size=256, workers=1)
+    build_lexical_index(documents, lexical_index_path(directory), embedding_config)
+    export_dense_index(store, dense_index_path(directory), embedding_config)
+    return len(documents)
+
+
+def retrievers(vector, index, links, k, rerank=None, candidates=12, budget_ms=150):
+    def vector_search(question):
+        return [document.metadata.get('link') for document in vector.similarity_search(question, k=k)]
+
+    def bm25(question):
+        return [links.get(chunk_id) for chunk_id, _ in index.search(question, k=k)]
+
+    hybrid = HybridRetriever(vector_store=vector, index=index, k=k, fetch_k=max(10, k))
+
+    def hybrid_search(question):
+        return [document.metadata.get('link') for document in hybrid.invoke(question)]
+
+    found = {'vector': vector_search, 'bm25': bm25, 'hybrid': hybrid_search}
+    if rerank:
+        reranker = create_reranker(rerank, vector, k=k, budget_ms=budget_ms)
+        # Not timed: the first questions would only wait for the model
+        reranker.wait()
+        wide = HybridRetriever(vector_store=vector, index=index, k=max(candidates, k),
+                               fetch_k=max(10, candidates, k))
+        reranked = RerankRetriever(retriever=wide, reranker=reranker)
+
+        def rerank_search(question):
+            return [document.metadata.get('link') for document in reranked.invoke(question)]
+
+        found['rerank'] = rerank_search
+        found['rerank'].reranker = reranker
+    return found
+
+
+def score(ranked_links, expected, ks):
+    expected = set(expected)
+    first = next((rank for rank, link in enumerate(ranked_links, 1) if link in expected), None)
+    recall = {k: len(expected & set(ranked_links[:k])) / len(expected) for k in ks}
+    return first, recall
+
+
+def evaluate_retrieval(golden, search, ks):
+    search(golden[0]['question'])  # warm-up: index pages, first embedding
+    rows = []
+    for item in golden:
+        start = time.perf_counter()
+        ranked = search(item['question'])
+        seconds = time.perf_counter() - start
+        first, recall = score(ranked, item['links'], ks)
+        rows.append({'id': item['id'], 'first_relevant_rank': first, 'recall': recall,
+                     'ms': seconds * 1000})
+    latencies = [row['ms'] for row in rows]
+    return {
+        'recall_at_k': {k: statistics.mean(row['recall'][k] for row in rows) for k in ks},
+        'mrr': statistics.mean(1 / row['first_relevant_rank'] if row['first_relevant_rank'] else 0.0
+                               for row in rows),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'questions': rows,
+    }
+
+
+async def evaluate_chain(golden, core):
+    rows = []
+    for item in golden:
+        start = time.perf_counter()
+        first = None
+        done = None
+        async for event in core.astream_answer(item['question'], f"benchmark-{item['id']}"):
+            if event['event'] == 'token' and event['text'] and first is None:
+                first = time.perf_counter() - start
+            elif event['event'] == 'done':
+                done = event
+        rows.append({'id': item['id'], 'ms': (time.perf_counter() - start) * 1000,
+                     'first_token_ms': (first or 0.0) * 1000, 'trace': done.get('trace')})
+    latencies = [row['ms'] for row in rows]
+    first_tokens = [row['first_token_ms'] for row in rows]
+    stages = sorted({stage for row in rows for stage in row['trace']['stages_ms']})
+    return {
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p50_first_token_ms': percentile(first_tokens, 0.5),
+        'p95_first_token_ms': percentile(first_tokens, 0.95),
+        'mean_stage_ms': {stage: statistics.mean(row['trace']['stages_ms'].get(stage, 0.0)
+                                                 for row in rows) for stage in stages},
+        'mean_prompt_tokens': statistics.mean(row['trace']['prompt_tokens'] for row in rows),
+        'questions': rows,
+    }
+
+
+def run_chain(golden, backend, persist_directory, offline, workdir, rerank=None):
+    # The chain of the 02x pages, without the retrieval and answer caches so
+    # that every question pays for its work, logging to the scratch directory
+    os.environ['GABY_LOG_DIRECTORY'] = os.path.join(workdir, 'logs')
+    os.environ['GABY_SESSION_STORE'] = 'memory://'
+    if rerank:
+        os.environ['GABY_RERANK'] = rerank
+    if offline:
+        from benchmarks.fake_openai import serve
+        server = serve(latency=0.05, token_latency=0.005, answer_tokens=40)
+        os.environ['OPENAI_API_BASE'] = f'http://127.0.0.1:{server.server_port}/v1'
+        os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    from gaby.core import GabyCore
+    core = GabyCore(backend, persist_directory=persist_directory, caches=False)
+    return asyncio.run(evaluate_chain(golden, core))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--golden', default='benchmarks/golden/v1.jsonl')
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--persist-directory', default='.chroma')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--chunk-overlap', type=int, default=20)
+    parser.add_argument('--embeddings', default='hashing',
+                        help='embedding backend of the --offline index')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--chain', action='store_true', help='also time the full chain')
+    parser.add_argument('--backend', default='openai', help='backend of the --chain run')
+    parser.add_argument('--rerank', help='reranker to compare, e.g. mmr or cross-encoder')
+    parser.add_argument('--candidates', type=int, default=12, help='candidates the reranker sees')
+    parser.add_argument('--rerank-budget-ms', type=float, default=150)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    workdir = tempfile.mkdtemp(prefix='gaby-eval-')
+    settings = {'golden': args.golden, 'questions': len(golden), 'offline': args.offline, 'k': args.k,
+                'rerank': args.rerank, 'candidates': args.candidates}
+    persist_directory = args.persist_directory
+    if args.offline:
+        persist_directory = os.path.join(workdir, '.chroma')
+        config = parse_embedding_config(args.embeddings)
+        start = time.perf_counter()
+        chunks = build_offline_index(persist_directory, args.chunk_size, args.chunk_overlap, config)
+        settings.update(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                        embeddings=config, chunks=chunks)
+        print(f"offline index: {chunks} chunks, {config['backend']}:{config['model']} "
+              f"embeddings, built in {time.perf_counter() - start:.1f}s")
+
+    vector = load_vector_store(persist_directory=persist_directory)
+    index = load_lexical_index(persist_directory)
+    if index is None:
+        raise SystemExit(f"No lexical index in {persist_directory}; run 01_generate_embeddings.py")
+    stored = vector.get(include=['metadatas'])
+    links = {chunk_id: (metadata or {}).get('link') for chunk_id, metadata in
+             zip(stored['ids'], stored['metadatas'])}
+
+    results = {'settings': settings, 'retrieval': {}}
+    for name, search in retrievers(vector, index, links, max(args.k), args.rerank, args.candidates,
+                                   args.rerank_budget_ms).items():
+        result = evaluate_retrieval(golden, search, args.k)
+        if hasattr(search, 'reranker'):
+            result['rerank'] = search.reranker.stats()
+        results['retrieval'][name] = result
+        recall = '  '.join(f"R@{k} {result['recall_at_k'][k]:.3f}" for k in args.k)
+        print(f"{name:>7}  {recall}  MRR {result['mrr']:.3f}  "
+              f"p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms")
+
+    if args.chain:
+        chain = run_chain(golden, args.backend, persist_directory, args.offline, workdir, args.rerank)
+        results['chain'] = dict(chain, backend=args.backend)
+        print(f"  chain  p50 {chain['p50_ms']:.0f} ms  p95 {chain['p95_ms']:.0f} ms  "
+              f"first token p50 {chain['p50_first_token_ms']:.0f} ms  "
+              f"p95 {chain['p95_first_token_ms']:.0f} ms")
+        print('         ' + ', '.join(f"{stage} {ms:.1f}" for stage, ms in chain['mean_stage_ms'].items()))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=1)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
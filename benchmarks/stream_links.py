@@ -0,0 +1,105 @@
+# Checks that StreamEnricher, fed an answer in pieces, returns exactly what
+# enrich() returns for the whole answer, and times both.
+#
+#   python -m benchmarks.stream_links [--answers 300]
+#
+# The answers are records of the knowledge file with titles of
+# titles_and_links.csv written into them the ways a model writes them:
+# bare, followed by their own, a grounded or a made-up URL, in brackets and
+# in bold. Each answer is split at every fixed piece size and at seeded
+# random sizes, so the check is the same on every run. Exits with status 1
+# on the first answer whose streamed output differs.
+import argparse
+import random
+import sys
+import time
+
+from gaby.links import StreamEnricher, TitleLinker, enrich, load_links, normalize_url
+from gaby.records import iter_records
+
+MENTIONS = (
+    '{title}',
+    '**{title}**',
+    '{title}: {link}',
+    '{title} ({link}).',
+    '{title} - {link}, ',
+    '[{title}]({link})',
+    '{title}: https://example.com/not-a-guide.',
+    '({fake})',
+    '{grounded}.',
+)
+
+
+def build_answers(csvall, count, seed=0):
+    rng = random.Random(seed)
+    titles = sorted(csvall)
+    with open('gabysknowledge_final.txt', 'r', encoding='utf-8') as file:
+        records = [record for record in iter_records(file)
+                   if record['link'] and 200 <= len(record['description']) <= 2000]
+    answers = []
+    for record in rng.sample(records, min(count, len(records))):
+        words = record['description'].split(' ')
+        for _ in range(rng.randint(1, 4)):
+            title = rng.choice(titles)
+            mention = rng.choice(MENTIONS).format(
+                title=rng.choice([title, title.title(), title.upper()]), link=csvall[title],
+                fake=f"https://example.com/{rng.randint(0, 999)}", grounded=record['link'])
+            words.insert(rng.randint(0, len(words)), mention)
+        answers.append((' '.join(words), {normalize_url(record['link'])}))
+    return answers
+
+
+def splits(answer, rng, sizes):
+    for size in sizes:
+        yield [answer[i:i + size] for i in range(0, len(answer), size)]
+    pieces, i = [], 0
+    while i < len(answer):
+        size = rng.randint(1, 12)
+        pieces.append(answer[i:i + size])
+        i += size
+    yield pieces
+
+
+def stream(linker, grounded, pieces):
+    enricher = StreamEnricher(linker, grounded)
+    return ''.join(enricher.feed(piece) for piece in pieces) + enricher.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default='titles_and_links.csv')
+    parser.add_argument('--answers', type=int, default=300)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 3, 5, 8, 16, 64])
+    args = parser.parse_args()
+
+    linker = TitleLinker(load_links(args.csv))
+    answers = build_answers(load_links(args.csv), args.answers)
+    rng = random.Random(0)
+    batch_seconds = stream_seconds = 0.0
+    checked = 0
+    for number, (answer, grounded) in enumerate(answers):
+        start = time.perf_counter()
+        expected = enrich(answer, linker, grounded)
+        batch_seconds += time.perf_counter() - start
+        for pieces in splits(answer, rng, args.sizes):
+            start = time.perf_counter()
+            streamed = stream(linker, grounded, pieces)
+            stream_seconds += time.perf_counter() - start
+            checked += 1
+            if streamed != expected:
+                at = next((i for i, (a, b) in enumerate(zip(streamed, expected)) if a != b),
+                          min(len(streamed), len(expected)))
+                print(f"answer {number}, {len(pieces)} pieces: streamed output differs at {at}")
+                print(f"  enrich():         {expected[max(at - 60, 0):at + 60]!r}")
+                print(f"  StreamEnricher:   {streamed[max(at - 60, 0):at + 60]!r}")
+                sys.exit(1)
+
+    runs = checked / len(answers) if answers else 0
+    print(f"{len(answers)} answers, {checked} splits: streamed output identical to enrich()")
+    print(f"enrich():        {batch_seconds / len(answers) * 1000:.2f} ms per answer")
+    print(f"StreamEnricher:  {stream_seconds / checked * 1000:.2f} ms per answer "
+          f"(mean over {runs:.0f} splits each)")
+
+
+if __name__ == '__main__':
+    main()
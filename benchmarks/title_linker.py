@@ -0,0 +1,67 @@
+# Compares the compiled TitleLinker against the original per-title match().
+#
+#   python -m benchmarks.title_linker [--rounds 5]
+#
+# Answers are read from the assistant messages of the conversation logs (see
+# gaby/logs.py); when no logs are around, paragraphs of the knowledge file
+# stand in for them.
+import argparse
+import time
+
+from gaby.links import TitleLinker, load_links
+from gaby.logs import read_log
+
+
+def legacy_match(csvall, ans):
+    for title, link in csvall.items():
+        if title.lower() in ans.lower():
+            ans = ans.replace(title, f"{title}: {link}")
+    return ans
+
+
+def load_answers(limit):
+    answers = [record['content'] for record in read_log() if record['role'] == 'assistant']
+    source = 'conversation logs'
+    if not answers:
+        with open('gabysknowledge_final.txt', 'r', encoding='utf-8') as file:
+            paragraphs = file.read().split('\n\n')
+        answers = [p for p in paragraphs if 200 <= len(p) <= 2000]
+        source = 'gabysknowledge_final.txt paragraphs'
+    return answers[:limit], source
+
+
+def answers_per_second(fn, answers, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for answer in answers:
+            fn(answer)
+        best = min(best, time.perf_counter() - start)
+    return len(answers) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default='titles_and_links.csv')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    csvall = load_links(args.csv)
+    answers, source = load_answers(args.limit)
+
+    start = time.perf_counter()
+    linker = TitleLinker(csvall)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    legacy = answers_per_second(lambda a: legacy_match(csvall, a), answers, args.rounds)
+    compiled = answers_per_second(linker, answers, args.rounds)
+
+    print(f"{len(csvall)} titles, {len(answers)} answers from {source}")
+    print(f"TitleLinker build: {build_ms:.1f} ms")
+    print(f"legacy match():    {legacy:10.0f} answers/s")
+    print(f"TitleLinker:       {compiled:10.0f} answers/s ({compiled / legacy:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
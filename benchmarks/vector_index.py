@@ -0,0 +1,245 @@
+# Load time, memory and query latency of the Chroma collection against the
+# memory-mapped vector index (gaby/vectors.py), in float32, float16 and int8.
+#
+#   python -m benchmarks.vector_index --offline --workers 4
+#   python -m benchmarks.vector_index --persist-directory .chroma
+#   python -m benchmarks.vector_index --offline --replicate 20 --stores float32 int8
+#
+# Every store is opened by --workers fresh processes, started one after the
+# other and kept alive together, as the API workers or Streamlit servers of
+# one node would. Each reports its import and load time, the first and the
+# p50/p95 query time over the golden questions, and, once all are loaded,
+# its RSS and PSS (proportional set size: shared pages are divided between
+# the processes mapping them, so the PSS of the workers adds up to what the
+# node spends). Overlap@k is the share of the exact float32 top-k each store
+# finds; Chroma's HNSW index is approximate. "MiB/1k" is what the search
+# itself reads per thousand chunks: the matrix, norms and int8 scales.
+# "disk/1k" is the whole export, texts included; int8 adds the float32
+# rows it rescores with, so it takes more disk than float32.
+#
+# int8 is then searched in this process with each --rescore factor, 0 being
+# the int8 ranking alone, for the recall and time each factor costs.
+# --replicate N stands in for a corpus N times larger: every vector is
+# repeated N times with a little noise (Chroma is left out then).
+#
+# --offline builds the knowledge file with the hashing embeddings in a
+# temporary directory (see benchmarks/retrieval_eval.py); without it the
+# questions are embedded with the collection's model.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STORES = ('chroma', 'float32', 'float16', 'int8')
+DTYPES = ('float32', 'float16', 'int8')
+
+
+def memory():
+    # kB figures of this process from /proc (Linux only)
+    values = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as file:
+            for line in file:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    values[name.lower()] = int(rest.split()[0])
+    except OSError:
+        import resource
+        values['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return values
+
+
+def child(store, persist_directory, path, queries_path, k, rescore):
+    start = time.perf_counter()
+    if store == 'chroma':
+        from langchain_chroma import Chroma
+    else:
+        from gaby.vectors import DenseIndex, DenseVectorStore
+    imported = time.perf_counter()
+    if store == 'chroma':
+        vector = Chroma('general_guides', persist_directory=persist_directory)
+    else:
+        vector = DenseVectorStore(DenseIndex(path, rescore=rescore), None)
+    loaded = time.perf_counter()
+
+    with open(queries_path, 'r', encoding='utf-8') as file:
+        queries = json.load(file)
+    results = []
+    latencies = []
+    for query in queries:
+        query_start = time.perf_counter()
+        documents = vector.similarity_search_by_vector(query, k=k)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        results.append([document.metadata.get('chunk_id') for document in documents])
+
+    print('ready', flush=True)
+    sys.stdin.readline()
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'load_ms': (loaded - imported) * 1000,
+        'first_query_ms': latencies[0],
+        'latencies': latencies[1:],
+        'results': results,
+        'memory': memory(),
+    }), flush=True)
+
+
+def run_store(store, persist_directory, path, queries_path, k, rescore, workers):
+    processes = []
+    for _ in range(workers):
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.vector_index', '--child', store,
+             '--persist-directory', persist_directory, '--path', path or '',
+             '--queries', queries_path, '--k', str(k), '--rescore', str(rescore)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        if process.stdout.readline().strip() != 'ready':
+            raise SystemExit(f"The {store} worker failed")
+        processes.append(process)
+    reports = []
+    for process in processes:
+        process.stdin.write('\n')
+        process.stdin.flush()
+        reports.append(json.loads(process.stdout.readline()))
+        process.wait()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--persist-directory', default='.chroma')
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--golden', default='benchmarks/golden/v1.jsonl')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--stores', nargs='+', default=list(STORES), choices=STORES)
+    parser.add_argument('--rescore', type=int, nargs='+', default=[0, 1, 2, 4, 8],
+                        help='int8 rescoring factors to compare; the workers use 4')
+    parser.add_argument('--replicate', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', choices=STORES, help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    parser.add_argument('--queries', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.persist_directory, args.path, args.queries, args.k, args.rescore[0])
+        return
+
+    from benchmarks.answer_modes import percentile
+    from benchmarks.retrieval_eval import build_offline_index, load_golden
+    from gaby.embeddings import collection_embeddings, get_embeddings, parse_embedding_config
+    from gaby.vectors import RESCORE, DenseIndex, disk_size, write_dense_index
+    import numpy as np
+
+    workdir = tempfile.mkdtemp(prefix='gaby-vectors-')
+    persist_directory = args.persist_directory
+    if args.offline:
+        persist_directory = os.path.join(workdir, '.chroma')
+        build_offline_index(persist_directory, 500, 20, parse_embedding_config('hashing'))
+
+    from langchain_chroma import Chroma
+    stored = Chroma('general_guides', persist_directory=persist_directory).get(
+        include=['embeddings', 'documents', 'metadatas'])
+    ids, vectors = stored['ids'], np.asarray(stored['embeddings'], dtype=np.float32)
+    texts, metadatas = stored['documents'], stored['metadatas']
+    if args.replicate > 1:
+        random = np.random.default_rng(0)
+        scale = np.linalg.norm(vectors, axis=1).mean() / np.sqrt(vectors.shape[1])
+        ids = [f'{chunk_id}-{copy}' for copy in range(args.replicate) for chunk_id in ids]
+        vectors = np.concatenate([vectors] + [vectors + random.normal(0, 0.3 * scale, vectors.shape)
+                                              for _ in range(args.replicate - 1)]).astype(np.float32)
+        texts = texts * args.replicate
+        metadatas = [dict(metadata or {}, chunk_id=chunk_id)
+                     for metadata, chunk_id in zip(metadatas * args.replicate, ids)]
+        args.stores = [name for name in args.stores if name != 'chroma']
+    del stored
+
+    paths = {}
+    sizes = {}
+    for dtype in DTYPES:
+        paths[dtype] = os.path.join(workdir, f'vectors-{dtype}')
+        write_dense_index(paths[dtype], ids, vectors, texts, metadatas,
+                          collection_embeddings(persist_directory), dtype)
+        searched = sum(os.path.getsize(os.path.join(paths[dtype], name))
+                       for name in ('vectors.bin', 'norms.bin', 'scales.bin')
+                       if os.path.exists(os.path.join(paths[dtype], name)))
+        disk = disk_size(paths[dtype])
+        sizes[dtype] = {'search_mib_per_1k': searched / 2**20 / len(ids) * 1000,
+                        'disk_mib_per_1k': disk / 2**20 / len(ids) * 1000}
+        print(f"{dtype:>8}: {searched / 2**20:7.1f} MiB searched, {disk / 2**20:7.1f} MiB on disk "
+              f"for {len(ids)} chunks of {vectors.shape[1]} dimensions")
+
+    embeddings = get_embeddings(collection_embeddings(persist_directory))
+    questions = [item['question'] for item in load_golden(args.golden)]
+    queries_path = os.path.join(workdir, 'queries.json')
+    with open(queries_path, 'w', encoding='utf-8') as file:
+        json.dump(embeddings.embed_documents(questions), file)
+
+    results = {}
+    for name in args.stores:
+        reports = run_store(name, persist_directory, paths.get(name), queries_path, args.k, RESCORE,
+                            args.workers)
+        latencies = [ms for report in reports for ms in report['latencies']]
+        results[name] = {
+            'import_ms': statistics.median(report['import_ms'] for report in reports),
+            'load_ms': statistics.median(report['load_ms'] for report in reports),
+            'first_query_ms': statistics.median(report['first_query_ms'] for report in reports),
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'rss_mib': statistics.mean(report['memory'].get('rss', 0) for report in reports) / 1024,
+            'pss_mib': statistics.mean(report['memory'].get('pss', 0) for report in reports) / 1024,
+            'results': reports[0]['results'],
+        }
+        results[name].update(sizes.get(name, {}))
+
+    if 'float32' in results:
+        reference = results['float32']['results']
+        for result in results.values():
+            result['overlap_at_k'] = statistics.mean(
+                len(set(found) & set(expected)) / len(expected) if expected else 1.0
+                for found, expected in zip(result['results'], reference))
+
+    print(f"{len(questions)} queries, k={args.k}, {args.workers} workers per store")
+    print(f"{'store':>8} {'import':>8} {'load':>8} {'first':>8} {'p50':>7} {'p95':>7} "
+          f"{'RSS':>9} {'PSS':>9} {'MiB/1k':>7} {'disk/1k':>7} {'overlap':>8}")
+    for name, result in results.items():
+        print(f"{name:>8} {result['import_ms']:6.0f}ms {result['load_ms']:6.1f}ms "
+              f"{result['first_query_ms']:6.2f}ms {result['p50_ms']:5.2f}ms {result['p95_ms']:5.2f}ms "
+              f"{result['rss_mib']:5.1f} MiB {result['pss_mib']:5.1f} MiB "
+              f"{result.get('search_mib_per_1k', float('nan')):7.3f} "
+              f"{result.get('disk_mib_per_1k', float('nan')):7.3f} "
+              f"{result.get('overlap_at_k', float('nan')):8.3f}")
+
+    # The recall int8 gives up against exact float32 search, per rescoring factor
+    with open(queries_path, 'r', encoding='utf-8') as file:
+        queries = json.load(file)
+    exact = DenseIndex(paths['float32'])
+    expected = [{number for number, _ in exact.search(query, args.k)} for query in queries]
+    results['int8_rescore'] = {}
+    print(f"int8 recall@{args.k} against float32:")
+    for rescore in args.rescore:
+        index = DenseIndex(paths['int8'], rescore=rescore)
+        index.search(queries[0], args.k)
+        latencies = []
+        recall = []
+        for query, wanted in zip(queries, expected):
+            start = time.perf_counter()
+            found = {number for number, _ in index.search(query, args.k)}
+            latencies.append((time.perf_counter() - start) * 1000)
+            recall.append(len(found & wanted) / len(wanted))
+        results['int8_rescore'][rescore] = {'recall': statistics.mean(recall),
+                                            'p50_ms': percentile(latencies, 0.5)}
+        print(f"  rescore {rescore:>2}: {statistics.mean(recall):.3f}, p50 {percentile(latencies, 0.5):.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=1)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
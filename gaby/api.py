@@ -0,0 +1,148 @@
+# Headless HTTP service for the Gaby chain, separate from the Streamlit UI.
+#
+#   python -m gaby.api --backend openai --port 8000 --workers 4
+#
+# POST /v1/chat with {"message": ..., "session_id": ..., "history": [...],
+# "backend": ..., "stream": true|false}. history holds the earlier
+# {"role", "content"} messages of the conversation; backend defaults to the
+# first one served. With "stream": true (or Accept: text/event-stream) the
+# answer is sent as server-sent events: "token" events with {"text": ...}
+# and a final "done" event with {"answer", "cached", "tokens", "trace"},
+# and "error": true when answering failed.
+# Otherwise the "done" payload is returned as JSON. GET /healthz reports the
+# serving stats and the question rewrite counts, and GET /metrics the stage
+# timings of this worker, in the Prometheus text format.
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+import tornado.httpserver
+import tornado.iostream
+import tornado.netutil
+import tornado.process
+import tornado.web
+
+from gaby.backends import BACKENDS
+from gaby.core import current_core, get_core
+from gaby.serving import serving_core
+from gaby.tracing import metrics
+
+
+class JSONHandler(tornado.web.RequestHandler):
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get('exc_info', (None, None))[1]
+        message = error.log_message if isinstance(error, tornado.web.HTTPError) else self._reason
+        self.finish({'error': message or self._reason})
+
+
+class ChatHandler(JSONHandler):
+    def initialize(self, backends):
+        self.backends = backends
+        self.task = None
+
+    def on_connection_close(self):
+        # The client went away: stop generating the answer
+        if self.task is not None:
+            self.task.cancel()
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'The body must be JSON')
+        message = body.get('message')
+        session_id = body.get('session_id')
+        if not isinstance(message, str) or not message.strip() or not session_id:
+            raise tornado.web.HTTPError(400, '"message" and "session_id" are required')
+        backend = body.get('backend') or self.backends[0]
+        if backend not in self.backends:
+            raise tornado.web.HTTPError(404, f'Backend {backend!r} is not served here')
+        stream = body.get('stream', 'text/event-stream' in self.request.headers.get('Accept', ''))
+
+        loop = asyncio.get_running_loop()
+        core = await loop.run_in_executor(None, get_core, backend, True)
+        events = core.astream_answer(message, str(session_id), body.get('history') or [])
+        self.task = asyncio.current_task()
+        try:
+            if stream:
+                self.set_header('Content-Type', 'text/event-stream')
+                self.set_header('Cache-Control', 'no-cache')
+                async for event in events:
+                    data = {key: value for key, value in event.items() if key != 'event'}
+                    self.write(f"event: {event['event']}\ndata: {json.dumps(data)}\n\n")
+                    await self.flush()
+            else:
+                async for event in events:
+                    if event['event'] == 'done':
+                        self.write({key: value for key, value in event.items() if key != 'event'})
+        except (asyncio.CancelledError, tornado.iostream.StreamClosedError):
+            await events.aclose()
+            return
+        finally:
+            self.task = None
+            core.release()
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.render())
+
+
+class HealthHandler(JSONHandler):
+    def initialize(self, backends):
+        self.backends = backends
+
+    def get(self):
+        backends = {}
+        for backend in self.backends:
+            backends[backend] = serving_core(backend).stats()
+            core = current_core(backend)
+            if core is not None:
+                backends[backend].update(core.stats())
+        self.write({'status': 'ok', 'backends': backends})
+
+
+def make_app(backends):
+    return tornado.web.Application([
+        (r'/v1/chat', ChatHandler, {'backends': backends}),
+        (r'/healthz', HealthHandler, {'backends': backends}),
+        (r'/metrics', MetricsHandler),
+    ])
+
+
+async def serve(sockets, backends):
+    # Build the cores before taking requests, so the first patron does not
+    # wait for the index and the clients to load
+    loop = asyncio.get_running_loop()
+    for backend in backends:
+        await loop.run_in_executor(None, get_core, backend)
+    server = tornado.httpserver.HTTPServer(make_app(backends))
+    server.add_sockets(sockets)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', nargs='+', default=['openai'], choices=list(BACKENDS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes sharing the port (0 for one per CPU)')
+    args = parser.parse_args()
+    # GABY_LOG_LEVEL=DEBUG adds the trace and both answers of every turn
+    logging.basicConfig(level=os.environ.get('GABY_LOG_LEVEL', 'WARNING').upper(),
+                        format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s')
+
+    # Bind before forking so every worker accepts on the same socket
+    sockets = tornado.netutil.bind_sockets(args.port, args.host)
+    if args.workers != 1:
+        tornado.process.fork_processes(args.workers)
+    print(f"Gaby API ({', '.join(args.backend)}) on http://{args.host}:{args.port}")
+    asyncio.run(serve(sockets, args.backend))
+
+
+if __name__ == '__main__':
+    main()
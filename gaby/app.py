@@ -0,0 +1,135 @@
+import os
+import streamlit as st
+from datetime import datetime
+from gaby.client import UNAVAILABLE_MESSAGE, gaby_client, save_feedback
+from gaby.serving import in_background
+
+# What differs between the 02x pages
+NOTICES = {
+    'gemini': """
+   <p style="color:red;"><b>FlameGPT can make mistakes, check important information on our website. This version of Gaby uses Gemini. <b/></p>
+""",
+    'openai': """
+   <p style="color:red;"><b>Gaby can make mistakes, check important information on our website. This version of Gaby uses ChatGPT. <b/></p>
+""",
+    'phi3': """
+   <p style="color:#fefefe;"><b>Gaby</b> can make mistakes, check important information on our website.</p>
+   <p>This version of <b>Gaby</b> uses PHI-3. </p>
+""",
+    'llama3': """
+   <p style="color:red;"><b>Gaby can make mistakes, check important information on our website. This version of Gaby uses ChatGPT. <b/></p>
+""",
+}
+
+
+# The chain, caches, link enrichment and logging live in gaby.core; set
+# GABY_API_URL to use a running gaby.api service instead of this process
+@st.cache_resource
+def load_client(backend):
+    return gaby_client(backend)
+
+
+def ask_us_form():
+    with st.form("Ask Us!"):
+        st.write("Not satisfied? Ask us a question, we will get back to you shortly!")
+
+        contact_method = st.selectbox(
+            "How would you like to be contacted?",
+            ("Email", "Mobile phone")
+        )
+
+        if contact_method is not None:
+            contact_info = st.text_input("Enter your email" if contact_method == "Email" else "Enter your mobile phone number")
+
+        inquiry = st.text_area("Enter your inquiry or question")
+
+        submitted = st.form_submit_button("Submit")
+
+
+def feedback_survey():
+    st.write("Feedback Survey")
+    rating = st.slider("Rate your experience with Gaby", 1, 5)
+    comments = st.text_area("Any comments or suggestions?")
+    email = st.text_input("Email")
+    if st.button("Submit Feedback"):
+        in_background(save_feedback, rating, comments, email)
+        st.write("Thank you for your feedback!")
+
+
+def debug_panel(trace):
+    # Shown with ?debug=1 in the page URL, or GABY_DEBUG=1
+    st.write("Last answer")
+    st.write(f"{trace['total_ms']:.0f} ms, {trace['prompt_tokens']} prompt and "
+             f"{trace['completion_tokens']} completion tokens, {trace['chunks']} chunks")
+    st.table({"ms": trace["stages_ms"]})
+
+
+def stream_reply(events, done):
+    for event in events:
+        if event["event"] == "token":
+            yield event["text"]
+        elif event["event"] == "done":
+            done.update(event)
+
+
+def run_page(backend):
+    gaby = load_client(backend)
+
+    concordia_logo = "conco-logo.png"
+    st.html("""
+  <style>
+    [alt=Logo] {
+      height: 10rem;
+    }
+  </style>
+        """)
+
+    st.logo(concordia_logo, link='https://library.concordia.ca/')
+    st.title("Concordia University Library Chatbot")
+
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    session_id = st.session_state.session_id
+
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+
+    user_input = st.chat_input("Say something")
+    st.html(f"""
+  <a href="https://library.concordia.ca/"style="color:red;">Visit Concordia Library's Website</a>{NOTICES[backend]}   <hr>
+        """)
+
+    debug = st.query_params.get("debug") == "1" or os.environ.get("GABY_DEBUG") == "1"
+    with st.sidebar:
+        if backend == 'gemini':
+            ask_us_form()
+        else:
+            feedback_survey()
+        debug_area = st.empty()
+
+    for message in st.session_state.messages:
+        role_prefix = "You:" if message["role"] == "user" else "Gaby:"
+        avatar = "gabyd2.png" if message["role"] == "assistant" else None
+        with st.chat_message(message["role"], avatar=avatar):
+            st.markdown(f"{role_prefix} {message['content']}")
+
+    if user_input:
+        st.session_state.messages.append({"role": "user", "content": user_input})
+        with st.chat_message("user"):
+            st.markdown(f"You: {user_input}")
+
+        done = {}
+        events = gaby.stream_answer(user_input, session_id, st.session_state.messages[:-1])
+        with st.chat_message("assistant", avatar="gabyd2.png"):
+            placeholder = st.empty()
+            placeholder.write_stream(stream_reply(events, done))
+            # No "done" event when the answer was cut off
+            final_response = done.get("answer", UNAVAILABLE_MESSAGE)
+            placeholder.markdown(f"Gaby: {final_response}")
+        st.session_state.messages.append({"role": "assistant", "content": final_response})
+        st.session_state.last_trace = done.get("trace")
+
+    if debug and st.session_state.get("last_trace"):
+        with debug_area.container():
+            debug_panel(st.session_state.last_trace)
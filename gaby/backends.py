@@ -0,0 +1,148 @@
+import json
+import os
+
+from gaby.context import MAX_PROMPT_TOKENS
+from gaby.postprocess import REWRITE_PROMPT, clean_urls, remove_extra_prefixes
+
+CONTEXTUALIZE_PROMPT = (
+    "Given a chat history and the latest user question "
+    "which might reference context in the chat history, "
+    "formulate a standalone question which can be understood "
+    "without the chat history. Do NOT answer the question, "
+    "just reformulate it if needed and otherwise return it as is."
+)
+
+SYSTEM_PROMPT = (
+    """You are Gaby, a helpful and resourceful AI library assistant at Concordia University Library.
+    Answer the questions from the perspective of Concordia University Library.
+    Ask follow-up questions for clarification if needed. If you don't know the answer, say that you don't know
+    and suggest speaking to a human librarian. Only provide links that are available in the context.
+    If asked about recommendations for books or articles always provide the link to the Sofia Discovery Tool and never recommend books.
+    """
+    "\n\n"
+    "{context}"
+)
+
+GEMINI_SYSTEM_PROMPT = (
+    """You are Gaby, a helpful AI library assistant at Concordia University Library.
+    Answer the questions from the perspective of Concordia University Library.
+    Ask follow-up questions for clarification if needed. If you don't know the answer, say that you don't know
+    and suggest speaking to a human librarian. Only provide links that are available in the context.
+    If asked about recommendations for books or articles always provide the link to the Sofia Discovery Tool and never recommend books
+    """
+    "\n\n"
+    "{context}"
+)
+
+PHI3_SYSTEM_PROMPT = """
+**For Retrieval:**
+
+<context>
+{context}
+</context>
+
+**Question to ask Gaby**
+You are Gaby, an AI library assistant at Concordia University Library. Answer the questions from the perspective of the context. Ask follow-up questions for clarification if needed. If you don't know the answer, say that you don't know and suggest speaking to a human librarian. Only provide links that are available in the context. If asked about recommendations for books, articles always provide the link to the Sofia Discovery Tool and never recommend books.
+"""
+
+SHORT_REWRITE_PROMPT = "Rewrite this to be more grammatically correct. Use clearer language."
+
+
+def openai_llm(model, temperature, key):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, temperature=temperature)
+
+
+def google_llm(model, temperature, key):
+    from langchain_google_genai import GoogleGenerativeAI
+    return GoogleGenerativeAI(model=model, google_api_key=key, temperature=temperature)
+
+
+def ollama_llm(model, temperature, key):
+    from langchain_community.llms import Ollama
+    from gaby.context import CONTEXT_WINDOWS
+    return Ollama(model=model, temperature=temperature, num_ctx=CONTEXT_WINDOWS.get(model, 2048))
+
+
+# Keyed by the "service_provider" of credentials.json. The SDK of a provider
+# is only imported when one of its backends is used.
+PROVIDERS = {
+    'openai': openai_llm,
+    'google': google_llm,
+    'ollama': ollama_llm,
+}
+
+# The defaults of every backend. history_aware backends rewrite follow-up
+# questions with the stored session history before retrieval; cleanup is
+# applied to the output of the grammar rewrite. prompt_budget is the token
+# budget of the answer prompt, capped at the model's window.
+BACKENDS = {}
+
+
+def register_backend(name, provider, model, temperature, system_prompt=SYSTEM_PROMPT,
+                     rewrite_prompt=REWRITE_PROMPT, history_aware=True, cleanup=None,
+                     prompt_budget=MAX_PROMPT_TOKENS):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider {provider!r}, expected one of {', '.join(PROVIDERS)}")
+    BACKENDS[name] = {
+        'provider': provider,
+        'model': model,
+        'temperature': temperature,
+        'system_prompt': system_prompt,
+        'rewrite_prompt': rewrite_prompt,
+        'history_aware': history_aware,
+        'cleanup': cleanup,
+        'prompt_budget': prompt_budget,
+    }
+
+
+# The hosted models get more context; the local ones stay at the default,
+# since prompt processing dominates their latency
+register_backend('gemini', 'google', 'gemini-pro', 0.5, system_prompt=GEMINI_SYSTEM_PROMPT,
+                 prompt_budget=8192)
+register_backend('openai', 'openai', 'gpt-3.5-turbo', 0.7, rewrite_prompt=SHORT_REWRITE_PROMPT,
+                 cleanup=clean_urls, prompt_budget=8192)
+register_backend('phi3', 'ollama', 'phi3', 0.1, system_prompt=PHI3_SYSTEM_PROMPT,
+                 history_aware=False, cleanup=remove_extra_prefixes)
+register_backend('llama3', 'ollama', 'llama3', 0.1, rewrite_prompt=SHORT_REWRITE_PROMPT,
+                 cleanup=clean_urls)
+
+# Settings credentials.json may override, next to the key
+CONFIGURABLE = ('model', 'temperature', 'system_prompt', 'rewrite_prompt', 'prompt_budget')
+
+
+def load_credentials(filepath='credentials.json'):
+    if not os.path.exists(filepath):
+        return []
+    with open(filepath, 'r') as file:
+        return json.load(file)
+
+
+def api_keys(credentials):
+    return {c.get('service_provider'): c.get('key') for c in credentials if c.get('key')}
+
+
+def backend_settings(backend, credentials=()):
+    # The registered defaults, overridden by the credentials.json entry of
+    # the backend's provider, then by an entry with "backend": <name>. Empty
+    # values, as in credentials_template.json, keep the default.
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    settings = dict(BACKENDS[backend], name=backend)
+    entries = [c for c in credentials
+               if c.get('service_provider') == settings['provider'] and not c.get('backend')]
+    entries += [c for c in credentials if c.get('backend') == backend]
+    for entry in entries:
+        for option in CONFIGURABLE:
+            if entry.get(option) not in (None, ''):
+                settings[option] = entry[option]
+    settings['temperature'] = float(settings['temperature'])
+    settings['prompt_budget'] = int(settings['prompt_budget'])
+    if '{context}' not in settings['system_prompt']:
+        settings['system_prompt'] += "\n\n{context}"
+    return settings
+
+
+def create_llm(settings, keys):
+    factory = PROVIDERS[settings['provider']]
+    return factory(settings['model'], settings['temperature'], keys.get(settings['provider']))
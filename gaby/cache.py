@@ -0,0 +1,280 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from gaby.ingest import document_id, load_manifest, manifest_path
+
+
+def normalize_question(question):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', question.lower()).split())
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ManifestGeneration:
+    # Re-reads the ingestion manifest only when its mtime changes
+    def __init__(self, persist_directory='.chroma'):
+        self.path = manifest_path(persist_directory)
+        self.mtime = None
+        self.value = None
+
+    def __call__(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self.mtime:
+            manifest = load_manifest(self.path) or {}
+            self.mtime = mtime
+            self.value = manifest.get('generation')
+        return self.value
+
+
+class DiskCache:
+    # Expired rows are purged, and the rows closest to expiry dropped past
+    # maxrows, when the cache is opened and every purge_every writes
+    def __init__(self, path, table, maxrows=10000, purge_every=100):
+        self.table = table
+        self.maxrows = maxrows
+        self.purge_every = purge_every
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, generation TEXT, expires REAL, value TEXT)"
+            )
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)")
+            self._purge()
+
+    def _purge(self):
+        self.db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (time.time(),))
+        self.db.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.maxrows,)
+        )
+
+    def get(self, key, generation):
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND generation IS ? AND expires > ?",
+                (key, generation, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, generation, value, ttl):
+        with self.lock, self.db:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                (key, generation, time.time() + ttl, json.dumps(value)),
+            )
+            self.writes += 1
+            if self.writes % self.purge_every == 0:
+                self._purge()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self, keep_generation=None):
+        with self.lock, self.db:
+            self.db.execute(f"DELETE FROM {self.table} WHERE generation IS NOT ?",
+                            (keep_generation,))
+
+
+class RetrievalCache:
+    def __init__(self, maxsize=1024, ttl=3600, disk_path=None, generation=None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.disk = DiskCache(disk_path, 'retrieval') if disk_path else None
+        self.generation = generation or (lambda: None)
+        self.current = self.generation()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _check_generation(self):
+        generation = self.generation()
+        if generation != self.current:
+            # The collection was re-ingested, so every cached result is stale
+            self.current = generation
+            self.memory.clear()
+            if self.disk:
+                self.disk.clear(keep_generation=generation)
+            self.counters['invalidations'] += 1
+        return generation
+
+    def key(self, question, k=None):
+        # With the number of chunks asked for, which the reranker changes
+        key = normalize_question(question)
+        return key if k is None else f'{key}|k={k}'
+
+    def get(self, question, k=None):
+        generation = self._check_generation()
+        key = self.key(question, k)
+        documents = self.memory.get(key)
+        if documents is not None:
+            self.counters['memory_hits'] += 1
+            return documents
+        if self.disk:
+            stored = self.disk.get(key, generation)
+            if stored is not None:
+                documents = [Document(page_content=d['page_content'], metadata=d['metadata'])
+                             for d in stored]
+                self.memory.set(key, documents)
+                self.counters['disk_hits'] += 1
+                return documents
+        self.counters['misses'] += 1
+        return None
+
+    def set(self, question, documents, k=None):
+        key = self.key(question, k)
+        self.memory.set(key, documents)
+        if self.disk:
+            self.disk.set(key, self.current, [
+                {'page_content': d.page_content, 'metadata': d.metadata} for d in documents
+            ], self.ttl)
+
+    def stats(self):
+        hits = self.counters['memory_hits'] + self.counters['disk_hits']
+        lookups = hits + self.counters['misses']
+        return dict(self.counters, hits=hits, size=len(self.memory),
+                    hit_rate=hits / lookups if lookups else 0.0)
+
+
+class CachedRetriever(BaseRetriever):
+    retriever: BaseRetriever
+    cache: Any
+    k: Optional[int] = None
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        documents = self.cache.get(query, self.k)
+        if documents is None:
+            documents = self.retriever.invoke(query, config={'callbacks': run_manager.get_child()})
+            self.cache.set(query, documents, self.k)
+        return documents
+
+
+def chunk_ids(documents):
+    return frozenset(document_id(d) for d in documents)
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+
+class SemanticAnswerCache:
+    # Final answers, looked up by the retrieved chunk ids and then by the
+    # cosine similarity of the standalone question's embedding
+    def __init__(self, embeddings, threshold=0.95, maxsize=1024, ttl=86400,
+                 per_context=8, generation=None):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.per_context = per_context
+        self.entries = TTLCache(maxsize, ttl)
+        self.generation = generation or (lambda: None)
+        self.current = self.generation()
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _check_generation(self):
+        generation = self.generation()
+        if generation != self.current:
+            self.current = generation
+            self.entries.clear()
+            self.counters['invalidations'] += 1
+
+    def get(self, question, documents):
+        self._check_generation()
+        candidates = self.entries.get(chunk_ids(documents))
+        if candidates:
+            vector = self.embeddings.embed_query(question)
+            score, answer = max((cosine(vector, v), a) for v, a in candidates)
+            if score >= self.threshold:
+                self.counters['hits'] += 1
+                return answer
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, question, documents, answer):
+        key = chunk_ids(documents)
+        vector = self.embeddings.embed_query(question)
+        candidates = (self.entries.get(key) or [])[-(self.per_context - 1):]
+        self.entries.set(key, candidates + [(vector, answer)])
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return dict(self.counters, size=len(self.entries),
+                    hit_rate=self.counters['hits'] / lookups if lookups else 0.0)
+
+
+_retrieval_caches = {}
+_retrieval_caches_lock = threading.Lock()
+
+
+def shared_retrieval_cache(persist_directory='.chroma', disk_path=None, maxsize=1024, ttl=3600):
+    # One cache per index and process, so it outlives Streamlit reruns
+    with _retrieval_caches_lock:
+        key = (persist_directory, disk_path)
+        if key not in _retrieval_caches:
+            _retrieval_caches[key] = RetrievalCache(
+                maxsize=maxsize, ttl=ttl, disk_path=disk_path,
+                generation=ManifestGeneration(persist_directory),
+            )
+        return _retrieval_caches[key]
+
+
+_answer_caches = {}
+
+
+def shared_answer_cache(embeddings, persist_directory='.chroma', threshold=0.95, variant=None):
+    # The answers are final, so one cache per index and variant: whatever
+    # shapes the answer after retrieval (backend, model, prompts, answer mode)
+    with _retrieval_caches_lock:
+        key = (persist_directory, variant, threshold)
+        if key not in _answer_caches:
+            _answer_caches[key] = SemanticAnswerCache(
+                embeddings, threshold=threshold,
+                generation=ManifestGeneration(persist_directory),
+            )
+        return _answer_caches[key]
@@ -0,0 +1,114 @@
+from operator import itemgetter
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
+
+from gaby.followup import ContextualizationGate
+from gaby.tracing import stage
+
+
+def format_documents(inputs):
+    return "\n\n".join(document.page_content for document in inputs["context"])
+
+
+def stuff_documents_chain(llm, prompt):
+    # What create_stuff_documents_chain builds, without importing the
+    # langchain package (and its text splitters) on the chat path
+    return (
+        RunnablePassthrough.assign(context=format_documents) | prompt | llm | StrOutputParser()
+    ).with_config(run_name="stuff_documents_chain", tags=["generation"])
+
+
+def create_rag_chain(llm, retriever, qa_prompt, contextualize_q_prompt=None, answer_cache=None,
+                     context_budget=None, history_key="chat_history", contextualize_gate=None):
+    # Same steps as create_retrieval_chain(create_history_aware_retriever(...),
+    # create_stuff_documents_chain(...)), but the standalone question is kept
+    # in the output as "question" so later stages can reuse it.
+    if contextualize_q_prompt is None:
+        question_chain = itemgetter("input")
+    else:
+        contextualize_chain = (contextualize_q_prompt | llm | StrOutputParser()).with_config(
+            tags=["contextualize"]
+        )
+        if context_budget is not None:
+            contextualize_chain = RunnableLambda(
+                lambda x: {**x, "chat_history": context_budget.trim_history(x["chat_history"])[0]}
+            ) | contextualize_chain
+        # The rewrite call is skipped on a first turn and for questions that
+        # stand on their own
+        gate = contextualize_gate or ContextualizationGate()
+        question_chain = RunnableBranch(
+            (lambda x: not gate(x), itemgetter("input")),
+            contextualize_chain,
+        )
+        if history_key != "chat_history":
+            # The history sent with the request, when there is one, rather
+            # than the session store's: another worker may have answered the
+            # earlier turns, and the default store is per process
+            question_chain = RunnableLambda(
+                lambda x: {**x, "chat_history": x.get(history_key) or x.get("chat_history") or []}
+            ) | question_chain
+    answer_chain = stuff_documents_chain(llm, qa_prompt)
+
+    chain = (
+        RunnablePassthrough.assign(question=question_chain)
+        .assign(context=itemgetter("question") | retriever)
+    )
+    if context_budget is not None:
+        # Merge overlapping chunks and trim chunks and history (the prompt's
+        # history_key) to the model's budget; the counts end up in "tokens"
+        def fit(inputs):
+            context, history, tokens = context_budget.fit(
+                inputs["question"], inputs["context"], inputs.get(history_key) or []
+            )
+            return {**inputs, "context": context, history_key: history, "tokens": tokens}
+
+        chain = chain | RunnableLambda(fit)
+    if answer_cache is None:
+        return chain | RunnablePassthrough.assign(answer=answer_chain)
+
+    # A cached answer is the final, already post-processed response, so the
+    # caller skips its own rewrite step when "cached" is set.
+    def lookup_answer(inputs):
+        with stage("answer_cache"):
+            return answer_cache.get(inputs["question"], inputs["context"])
+
+    lookup = RunnableLambda(lookup_answer)
+    return (
+        chain
+        | RunnablePassthrough.assign(cached=lookup)
+        | RunnablePassthrough.assign(answer=RunnableBranch(
+            (lambda x: x["cached"] is not None, itemgetter("cached")),
+            answer_chain,
+        ))
+    )
+
+
+def merge_chunk(result, chunk):
+    for key, value in chunk.items():
+        if isinstance(value, str) and isinstance(result.get(key), str):
+            result[key] += value
+        else:
+            result[key] = value
+
+
+class StreamedResponse:
+    # Iterating yields the "answer" text as it is generated; every other
+    # output key (question, context, cached, ...) is collected in .result.
+    def __init__(self, chain, inputs, config=None):
+        self.chunks = chain.stream(inputs, config=config)
+        self.result = {}
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            merge_chunk(self.result, chunk)
+            if chunk.get("answer"):
+                yield chunk["answer"]
+
+
+async def answer_pieces(chunks, result):
+    # The async counterpart of StreamedResponse, over the chunks of astream
+    async for chunk in chunks:
+        merge_chunk(result, chunk)
+        if chunk.get("answer"):
+            yield chunk["answer"]
@@ -0,0 +1,98 @@
+import csv
+import json
+import logging
+import os
+import threading
+import urllib.error
+import urllib.request
+
+UNAVAILABLE_MESSAGE = ("Sorry, I can't be reached right now. "
+                       "Please try again in a moment.")
+
+logger = logging.getLogger(__name__)
+
+
+def save_feedback(rating, comments, email, filename='surveys/feedback.csv'):
+    # The feedback survey is stored by the page itself, not the service
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, mode='a', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow([rating, comments, email])
+
+
+class RemoteGaby:
+    # Talks to the HTTP service in gaby/api.py
+    def __init__(self, url, backend, timeout=120):
+        self.url = url.rstrip('/')
+        self.backend = backend
+        self.timeout = timeout
+
+    def stream_answer(self, message, session_id, history=()):
+        body = json.dumps({'message': message, 'session_id': session_id, 'history': list(history),
+                           'backend': self.backend, 'stream': True}).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/v1/chat", data=body, headers={
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        })
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except (urllib.error.URLError, OSError) as error:
+            logger.warning("Gaby API unavailable: %s", error)
+            yield {'event': 'done', 'answer': UNAVAILABLE_MESSAGE, 'cached': False, 'tokens': None}
+            return
+        # Closing the response (when the caller stops iterating) drops the
+        # connection, which cancels the answer on the server
+        done = False
+        with response:
+            event = 'message'
+            try:
+                for line in response:
+                    line = line.decode('utf-8').rstrip('\r\n')
+                    if line.startswith('event:'):
+                        event = line[len('event:'):].strip()
+                    elif line.startswith('data:'):
+                        done = done or event == 'done'
+                        yield dict(json.loads(line[len('data:'):]), event=event)
+            except (OSError, ValueError) as error:
+                logger.warning("Gaby API stream broken: %s", error)
+        if not done:
+            # The stream ended without its "done" event
+            yield {'event': 'done', 'answer': UNAVAILABLE_MESSAGE, 'cached': False, 'tokens': None,
+                   'error': True}
+
+
+class LocalGaby:
+    # Runs the core in this process, on the serving event loop
+    def __init__(self, backend, preload=True):
+        self.backend = backend
+        if preload:
+            # The LLM SDK, langchain and Chroma are only imported with the
+            # core; build it while the first page renders and the patron types
+            threading.Thread(target=self.preload, daemon=True).start()
+
+    def preload(self):
+        from gaby.core import get_core
+        try:
+            get_core(self.backend)
+        except Exception:
+            logger.exception("Preloading the core failed")
+
+    def stream_answer(self, message, session_id, history=()):
+        from gaby.core import get_core
+        from gaby.serving import iterate_in_loop, serving_loop
+        core = get_core(self.backend, acquire=True)
+        try:
+            yield from iterate_in_loop(core.astream_answer(message, session_id, history))
+        finally:
+            # Released on the loop, after the answer has taken its own
+            # reference or been cancelled before starting
+            serving_loop().call_soon_threadsafe(core.release)
+
+
+def gaby_client(backend):
+    # GABY_API_URL points the pages at a running gaby.api service; without
+    # it the chain runs inside the Streamlit process
+    url = os.environ.get('GABY_API_URL')
+    if url:
+        return RemoteGaby(url, backend)
+    return LocalGaby(backend)
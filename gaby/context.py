@@ -0,0 +1,178 @@
+import math
+
+# Context windows in tokens. Ollama defaults to a 2048-token window and
+# silently drops the start of longer prompts, so the Ollama clients are
+# created with num_ctx set to these values.
+CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gemini-pro': 30720,
+    'phi3': 4096,
+    'llama3': 8192,
+}
+
+# The default prompt budget of a backend (see register_backend). Prompts are
+# kept well under the larger windows: past a few thousand tokens extra
+# context mostly adds latency and cost
+MAX_PROMPT_TOKENS = 4096
+
+_encoding = None
+
+
+def _get_encoding():
+    # cl100k_base is exact for gpt-3.5-turbo and close enough for the others;
+    # without tiktoken (or its cached vocabulary) fall back to ~4 chars a token
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _message_content(message):
+    # st.session_state.messages holds dicts, the session store holds messages
+    return message['content'] if isinstance(message, dict) else message.content
+
+
+def message_tokens(message):
+    # Every chat message carries a few tokens of role and separators
+    return count_tokens(_message_content(message)) + 4
+
+
+def _split(document):
+    # Chunks written by record_documents are "title: ...\n<text>\nlink: ..."
+    lines = document.page_content.split('\n')
+    head = lines[0] if lines and lines[0].startswith('title:') else None
+    tail = lines[-1] if len(lines) > 1 and lines[-1].startswith('link:') else None
+    body = '\n'.join(lines[1 if head else 0:-1 if tail else len(lines)])
+    return head, body, tail
+
+
+def _overlap(first, second, max_overlap, min_overlap=3):
+    # Length of the longest end of first that starts second
+    for size in range(min(max_overlap, len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def merge_overlaps(documents, max_overlap=20):
+    # Neighbouring chunks of one record repeat up to chunk_overlap characters
+    # (and the record's title and link lines); join them into one document
+    # placed at the rank of the best ranked chunk.
+    merged = []
+    for document in documents:
+        key = (document.metadata.get('title'), document.metadata.get('link'))
+        head, body, tail = _split(document)
+        for entry in merged:
+            if entry['text'] == document.page_content:
+                break
+            if entry['key'] != key or not any(key):
+                continue
+            if body in entry['body']:
+                break
+            size = _overlap(entry['body'], body, max_overlap)
+            if size:
+                entry['body'] += body[size:]
+                break
+            size = _overlap(body, entry['body'], max_overlap)
+            if size:
+                entry['body'] = body + entry['body'][size:]
+                break
+        else:
+            merged.append({'key': key, 'document': document, 'head': head, 'tail': tail,
+                           'body': body, 'text': document.page_content})
+    result = []
+    for entry in merged:
+        document = entry['document']
+        text = '\n'.join(part for part in (entry['head'], entry['body'], entry['tail']) if part)
+        if text != document.page_content:
+            document = document.__class__(page_content=text, metadata=document.metadata)
+        result.append(document)
+    return result
+
+
+class ContextBudget:
+    # Fits the retrieved chunks and the chat history of one answer prompt
+    # into max_tokens, keeping reserve tokens free for the answer
+    def __init__(self, max_tokens, system_prompt='', reserve=512, history_share=0.25,
+                 max_overlap=20, min_chunk_tokens=64):
+        self.max_tokens = max_tokens
+        self.reserve = reserve
+        self.history_share = history_share
+        self.max_overlap = max_overlap
+        self.min_chunk_tokens = min_chunk_tokens
+        self.system_tokens = count_tokens(system_prompt.replace('{context}', ''))
+
+    def trim_history(self, history, max_tokens=None):
+        # The most recent messages that fit, oldest first
+        if max_tokens is None:
+            max_tokens = int((self.max_tokens - self.reserve - self.system_tokens) * self.history_share)
+        kept, used = [], 0
+        for message in reversed(history):
+            tokens = message_tokens(message)
+            if used + tokens > max_tokens:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        return kept, used
+
+    def fit(self, question, documents, history):
+        question_tokens = count_tokens(question)
+        available = max(self.max_tokens - self.reserve - self.system_tokens - question_tokens, 0)
+        history, history_tokens = self.trim_history(history, int(available * self.history_share))
+
+        # Chunks come ranked by the retriever: keep the best ones, shortening
+        # the last one when enough room is left for it to be useful
+        merged = merge_overlaps(documents, self.max_overlap)
+        remaining = available - history_tokens
+        kept = []
+        for document in merged:
+            tokens = count_tokens(document.page_content)
+            if tokens > remaining:
+                if remaining >= self.min_chunk_tokens:
+                    document = document.__class__(
+                        page_content=truncate_tokens(document.page_content, remaining),
+                        metadata=document.metadata,
+                    )
+                    kept.append(document)
+                    remaining = 0
+                break
+            kept.append(document)
+            remaining -= tokens
+
+        context_tokens = available - history_tokens - remaining
+        usage = {
+            'budget': self.max_tokens,
+            'system': self.system_tokens,
+            'question': question_tokens,
+            'context': context_tokens,
+            'history': history_tokens,
+            'prompt': self.system_tokens + question_tokens + context_tokens + history_tokens,
+            'chunks': len(kept),
+            'retrieved': len(documents),
+        }
+        return kept, history, usage
+
+
+def context_budget(model, system_prompt='', max_tokens=MAX_PROMPT_TOKENS, **kwargs):
+    # Never more than the model's window, when it is known
+    max_tokens = min(CONTEXT_WINDOWS.get(model, max_tokens), max_tokens)
+    return ContextBudget(max_tokens, system_prompt, **kwargs)
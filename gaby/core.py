@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from gaby.backends import (CONTEXTUALIZE_PROMPT, api_keys, backend_settings, create_llm,
+                            load_credentials)
+from gaby.cache import CachedRetriever, shared_answer_cache, shared_retrieval_cache
+from gaby.chain import answer_pieces, create_rag_chain
+from gaby.context import context_budget
+from gaby.embeddings import load_vector_store
+from gaby.followup import ContextualizationGate
+from gaby.history import create_session_store, window_messages
+from gaby.lexical import hybrid_retriever
+from gaby.links import StreamEnricher, TitleLinker, enrich, grounded_links, load_links
+from gaby.logs import conversation_log, log_record
+from gaby.postprocess import add_formatting_rules, postprocess, single_pass_enabled
+from gaby.rerank import RerankRetriever, reranker_from_env
+from gaby.resources import file_version, index_version
+from gaby.serving import ERROR_MESSAGE, TIMEOUT_MESSAGE, in_background, serving_core
+from gaby.tracing import TraceCallback, metrics, start_trace
+
+LINKS_CSV = 'titles_and_links.csv'
+
+logger = logging.getLogger(__name__)
+
+
+_session_store = None
+
+
+def shared_session_store():
+    global _session_store
+    with _cores_lock:
+        if _session_store is None:
+            _session_store = create_session_store(os.environ.get('GABY_SESSION_STORE', 'memory://'))
+        return _session_store
+
+
+class GabyCore:
+    # The chain, caches, link enrichment and logging of one backend. Used by
+    # the HTTP service (gaby/api.py) and, in process, by the Streamlit pages.
+    def __init__(self, backend, persist_directory='.chroma', caches=True):
+        credentials = load_credentials()
+        spec = backend_settings(backend, credentials)
+        self.backend = backend
+        self.settings = spec
+        self.cleanup = spec['cleanup']
+        self.single_pass = single_pass_enabled()
+
+        keys = api_keys(credentials)
+        # Also needed for the embeddings when the collection used OpenAI
+        if keys.get('openai'):
+            os.environ['OPENAI_API_KEY'] = keys['openai']
+        vector = load_vector_store(persist_directory=persist_directory)
+        self.vector_store = vector
+        self.llm = create_llm(spec, keys)
+
+        system_prompt = spec['system_prompt']
+        if self.single_pass:
+            system_prompt = add_formatting_rules(system_prompt)
+
+        self.reranker = reranker_from_env(vector)
+        k = 3
+        if self.reranker is None:
+            retriever = hybrid_retriever(vector, persist_directory, k=k)
+        else:
+            # A wider set of candidates, cut down to the best few by the reranker
+            k = int(os.environ.get('GABY_RERANK_CANDIDATES', 12))
+            retriever = hybrid_retriever(vector, persist_directory, k=k, fetch_k=max(10, k))
+        self.answer_cache = None
+        if caches:
+            # GABY_RETRIEVAL_CACHE_PATH= (empty) keeps the cache in memory only
+            disk_path = os.environ.get('GABY_RETRIEVAL_CACHE_PATH', '.retrieval_cache.sqlite') or None
+            retrieval_cache = shared_retrieval_cache(persist_directory, disk_path=disk_path)
+            retriever = CachedRetriever(retriever=retriever, cache=retrieval_cache, k=k)
+            variant = (backend, 'single-pass' if self.single_pass else 'rewrite', spec['model'],
+                       spec['temperature'], spec['system_prompt'], spec['rewrite_prompt'],
+                       spec['prompt_budget'])
+            self.answer_cache = shared_answer_cache(vector.embeddings, persist_directory,
+                                                    variant=variant)
+        if self.reranker is not None:
+            # Outside the retrieval cache, so an answer that fell back to the
+            # retriever's order is not cached that way
+            retriever = RerankRetriever(retriever=retriever, reranker=self.reranker)
+        self.contextualize_gate = ContextualizationGate()
+        budget = context_budget(spec['model'], system_prompt, spec['prompt_budget'])
+
+        if spec['history_aware']:
+            contextualize_q_prompt = ChatPromptTemplate.from_messages([
+                ("system", CONTEXTUALIZE_PROMPT),
+                MessagesPlaceholder("chat_history"),
+                ("human", "{input}")
+            ])
+            qa_prompt = ChatPromptTemplate.from_messages([
+                ("system", system_prompt),
+                MessagesPlaceholder("store"),
+                ("human", "{input}"),
+            ])
+            self.history_key = "store"
+            self.chain = RunnableWithMessageHistory(
+                create_rag_chain(self.llm, retriever, qa_prompt, contextualize_q_prompt,
+                                 self.answer_cache, context_budget=budget, history_key="store",
+                                 contextualize_gate=self.contextualize_gate),
+                shared_session_store().get_history,
+                input_messages_key="input",
+                history_messages_key="chat_history",
+                output_messages_key="answer"
+            )
+        else:
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", system_prompt),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("user", "{input}"),
+            ])
+            self.history_key = "chat_history"
+            self.chain = create_rag_chain(self.llm, retriever, prompt, answer_cache=self.answer_cache,
+                                          context_budget=budget)
+
+        self.rewrite_chain = (ChatPromptTemplate.from_messages([
+            ("system", spec['rewrite_prompt']),
+            ("user", "{input}")
+        ]) | self.llm | StrOutputParser()).with_config(tags=["rewrite"])
+        self.serving = serving_core(backend)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.retired = False
+        self.linker_version = None
+        self._linker = None
+        # Compiled here rather than in the first answer's enrichment
+        self.linker
+
+    @property
+    def linker(self):
+        version = file_version(LINKS_CSV)
+        if self._linker is None or version != self.linker_version:
+            self._linker = TitleLinker(load_links(LINKS_CSV))
+            self.linker_version = version
+        return self._linker
+
+    def log(self, session_id, role, content, **extra):
+        conversation_log().log(log_record(self.backend, session_id, role, content, **extra))
+
+    async def astream_answer(self, message, session_id, history=()):
+        # Yields {"event": "token", "text": ...} for the text to show as it
+        # is generated, then {"event": "done", "answer": ...} with the final
+        # answer, which replaces the streamed text. The "done" event always
+        # comes; when answering failed it has "error": true and an apology.
+        trace = start_trace(self.backend)
+        first_token_ms = None
+        events = self._answer_events(message, session_id, history, trace)
+        self.acquire()
+        try:
+            with trace.stage("logging"):
+                self.log(session_id, "user", message)
+            async for event in events:
+                if event["event"] == "token" and event["text"] and first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - trace.started) * 1000, 1)
+                elif event["event"] == "done":
+                    trace.finish()
+                    event = dict(event, trace=trace.summary())
+                    with trace.stage("logging"):
+                        self.log(session_id, "assistant", event["answer"],
+                                 latency_ms=event["trace"]["total_ms"], first_token_ms=first_token_ms,
+                                 tokens=event["tokens"], cached=event["cached"],
+                                 stages=event["trace"]["stages_ms"],
+                                 prompt_tokens=event["trace"]["prompt_tokens"],
+                                 completion_tokens=event["trace"]["completion_tokens"])
+                    self.record(trace)
+                yield event
+        finally:
+            # Stops the LLM call when the caller goes away mid-answer
+            await events.aclose()
+            self.release()
+
+    def record(self, trace):
+        metrics.observe(trace)
+        logger.debug("Trace: %s", trace.summary())
+        # GABY_METRICS_FILE keeps a Prometheus text file up to date, for
+        # processes without the /metrics endpoint of gaby.api
+        path = os.environ.get("GABY_METRICS_FILE")
+        if path:
+            in_background(metrics.write, path)
+
+    async def _answer_events(self, message, session_id, history, trace):
+        if message.strip().lower() == "bye":
+            yield {"event": "done", "answer": "Goodbye!", "cached": False, "tokens": None}
+            return
+
+        inputs = {"input": message, self.history_key: window_messages(list(history))}
+        callbacks = [TraceCallback(trace)]
+        config = {"configurable": {"session_id": session_id}, "callbacks": callbacks}
+        result = {}
+        error = False
+        try:
+            pieces = answer_pieces(self.serving.astream(self.chain, inputs, config), result)
+            try:
+                first = await pieces.__anext__()
+            except StopAsyncIteration:
+                first = ""
+            cached = result.get('cached') is not None
+            if cached:
+                streamed = first
+                yield {"event": "token", "text": first}
+                async for piece in pieces:
+                    streamed += piece
+                    yield {"event": "token", "text": piece}
+                final_response = streamed
+            elif self.single_pass:
+                # Titles are linked and URLs checked as the tokens arrive
+                with trace.stage("enrichment"):
+                    enricher = StreamEnricher(self.linker, grounded_links(result.get('context') or []))
+                    streamed = enricher.feed(first)
+                yield {"event": "token", "text": streamed}
+                async for piece in pieces:
+                    with trace.stage("enrichment"):
+                        text = enricher.feed(piece)
+                    streamed += text
+                    yield {"event": "token", "text": text}
+                with trace.stage("enrichment"):
+                    text = enricher.flush()
+                yield {"event": "token", "text": text}
+                final_response = postprocess(streamed + text)
+            else:
+                answer = first
+                async for piece in pieces:
+                    answer += piece
+                grounded = grounded_links(result.get('context') or [])
+                with trace.stage("enrichment"):
+                    enriched_answer = enrich(answer, self.linker, grounded)
+                logger.debug("Answer before the rewrite: %s", enriched_answer)
+                # The rewrite is an LLM call too: its URLs are checked
+                # against the same chunks as it streams
+                streamed = ""
+                enricher = StreamEnricher(self.linker, grounded)
+                rewrite = self.serving.astream(self.rewrite_chain, {"input": enriched_answer},
+                                               {"callbacks": callbacks})
+                async for piece in rewrite:
+                    with trace.stage("enrichment"):
+                        text = enricher.feed(piece)
+                    streamed += text
+                    yield {"event": "token", "text": text}
+                with trace.stage("enrichment"):
+                    text = enricher.flush()
+                streamed += text
+                yield {"event": "token", "text": text}
+                final_response = self.cleanup(streamed) if self.cleanup else streamed
+            if not cached and self.answer_cache is not None:
+                # Embedding the question is a blocking call
+                with trace.stage("answer_cache"):
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.answer_cache.put, result['question'], result['context'], final_response
+                    )
+        except TimeoutError:
+            cached = False
+            final_response = TIMEOUT_MESSAGE
+        except Exception:
+            # Any other LLM, network or store error still ends the answer
+            # with a "done" event, after whatever tokens were sent
+            logger.exception("Answering with %s failed", self.backend)
+            cached = False
+            error = True
+            final_response = ERROR_MESSAGE
+
+        trace.chunks = (result.get('tokens') or {}).get('chunks', 0)
+        trace.cached = cached
+        logger.debug("Final answer: %s", final_response)
+        done = {"event": "done", "answer": final_response, "cached": cached,
+                "tokens": result.get('tokens')}
+        if error:
+            done["error"] = True
+        yield done
+
+    def acquire(self):
+        # A reference to the core, which keeps its index files open until
+        # the matching release() even when get_core has replaced it
+        with self.lock:
+            self.active += 1
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            idle = self.retired and not self.active
+        if idle:
+            self.close()
+
+    def retire(self):
+        # Called when get_core replaces this core; its index files are
+        # closed once the answers still running on it are done
+        with self.lock:
+            self.retired = True
+            idle = not self.active
+        if idle:
+            self.close()
+
+    def close(self):
+        close = getattr(self.vector_store, 'close', None)
+        if close is not None:
+            close()
+
+    def stats(self):
+        # Reported per backend by /healthz
+        stats = {'contextualization': self.contextualize_gate.stats()}
+        if self.reranker is not None:
+            stats['rerank'] = self.reranker.stats()
+        return stats
+
+    async def aanswer(self, message, session_id, history=()):
+        async for event in self.astream_answer(message, session_id, history):
+            if event["event"] == "done":
+                return event
+
+
+_cores = {}
+_cores_lock = threading.Lock()
+_build_locks = {}
+
+
+def current_core(backend):
+    # The core already built for the backend, without building one
+    with _cores_lock:
+        entry = _cores.get(backend)
+    return entry[1] if entry else None
+
+
+def get_core(backend, acquire=False):
+    # One core per backend and process, rebuilt when credentials.json, the
+    # index or the answer mode changes. Callers that arrive while a core is
+    # being built wait for it instead of building their own. With acquire,
+    # the core is returned with a reference taken (see GabyCore.acquire)
+    # while it is still the current one, so it cannot be retired and closed
+    # before the caller starts answering; the caller must release() it.
+    version = (file_version('credentials.json'), index_version(), single_pass_enabled())
+    with _cores_lock:
+        entry = _cores.get(backend)
+        build_lock = _build_locks.setdefault(backend, threading.Lock())
+    if entry is None or entry[0] != version:
+        with build_lock:
+            with _cores_lock:
+                entry = _cores.get(backend)
+            if entry is None or entry[0] != version:
+                old = entry
+                entry = (version, GabyCore(backend))
+                with _cores_lock:
+                    _cores[backend] = entry
+                if old is not None:
+                    old[1].retire()
+    if acquire:
+        with _cores_lock:
+            entry = _cores[backend]
+            entry[1].acquire()
+    return entry[1]
@@ -0,0 +1,118 @@
+import hashlib
+import math
+import os
+from collections import Counter
+
+from langchain_core.embeddings import Embeddings
+
+from gaby.cache import TTLCache
+from gaby.ingest import load_manifest, manifest_path
+from gaby.lexical import tokenize
+
+DEFAULT_MODELS = {
+    'openai': 'text-embedding-ada-002',
+    'sentence-transformers': 'sentence-transformers/all-MiniLM-L6-v2',
+    'ollama': 'nomic-embed-text',
+    'hashing': '1024',
+}
+
+# Collections built before the backend was recorded used OpenAIEmbeddings()
+LEGACY_EMBEDDINGS = {'backend': 'openai', 'model': DEFAULT_MODELS['openai']}
+
+
+def embedding_config(backend='openai', model=None):
+    if backend not in DEFAULT_MODELS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, "
+                         f"expected one of {', '.join(DEFAULT_MODELS)}")
+    return {'backend': backend, 'model': model or DEFAULT_MODELS[backend]}
+
+
+def parse_embedding_config(value):
+    # "ollama" or "ollama:nomic-embed-text"
+    backend, _, model = value.partition(':')
+    return embedding_config(backend.strip(), model.strip() or None)
+
+
+def get_embeddings(config):
+    backend, model = config['backend'], config['model']
+    if backend == 'openai':
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model)
+    if backend == 'sentence-transformers':
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model)
+    if backend == 'ollama':
+        from langchain_community.embeddings import OllamaEmbeddings
+        return OllamaEmbeddings(model=model)
+    if backend == 'hashing':
+        return HashingEmbeddings(int(model))
+    raise ValueError(f"Unknown embedding backend {backend!r}")
+
+
+class HashingEmbeddings(Embeddings):
+    # The words of a text hashed into a fixed number of signed dimensions.
+    # Deterministic and offline, for benchmarks and tests (the model is the
+    # number of dimensions); it only matches shared words, unlike a model.
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    def embed_query(self, text):
+        vector = [0.0] * self.dimensions
+        for token, count in Counter(tokenize(text)).items():
+            digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dimensions] += sign * (1.0 + math.log(count))
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    # Memoizes query embeddings, so the retriever and the answer cache embed
+    # a given question only once
+    def __init__(self, embeddings, maxsize=1024, ttl=3600):
+        self.embeddings = embeddings
+        self.queries = TTLCache(maxsize, ttl)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        vector = self.queries.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.queries.set(text, vector)
+        return vector
+
+
+def collection_embeddings(persist_directory='.chroma'):
+    manifest = load_manifest(manifest_path(persist_directory))
+    if manifest is None:
+        return LEGACY_EMBEDDINGS
+    return manifest.get('embeddings', LEGACY_EMBEDDINGS)
+
+
+def load_vector_store(collection_name='general_guides', persist_directory='.chroma',
+                      config=None):
+    stored = collection_embeddings(persist_directory)
+    if config is None and os.environ.get('GABY_EMBEDDINGS'):
+        config = parse_embedding_config(os.environ['GABY_EMBEDDINGS'])
+    if config is not None and config != stored:
+        raise ValueError(
+            f"The {collection_name!r} collection in {persist_directory} was embedded with "
+            f"{stored['backend']}:{stored['model']}, but {config['backend']}:{config['model']} "
+            f"is configured. Re-run 01_generate_embeddings.py --embeddings "
+            f"{config['backend']}:{config['model']} or change the configuration."
+        )
+    embeddings = CachedEmbeddings(get_embeddings(stored))
+    # The memory-mapped export of the collection, when it is current, unless
+    # GABY_VECTOR_STORE=chroma
+    if os.environ.get('GABY_VECTOR_STORE', 'mmap') != 'chroma':
+        from gaby.vectors import DenseVectorStore, load_dense_index
+        index = load_dense_index(persist_directory)
+        if index is not None:
+            return DenseVectorStore(index, embeddings)
+    from langchain_chroma import Chroma
+    return Chroma(collection_name, embeddings, persist_directory=persist_directory)
@@ -0,0 +1,62 @@
+import re
+import threading
+
+WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# Words that point back at something said earlier in the conversation
+REFERENCES = frozenset("""
+it it's its itself they them their theirs those these this that he him his she her
+one ones same such former latter above previous earlier else another again
+""".split())
+
+EXISTENTIAL = frozenset('is are was were be been will any anything nothing'.split())
+
+# Ways a question picks up where the last one left off
+FOLLOW_UP_STARTS = (
+    'and', 'also', 'but', 'or', 'so', 'then', 'what about', 'how about', 'what if',
+    'why not', 'which one', 'more', 'ok', 'okay', 'yes', 'no', 'thanks',
+)
+
+
+def is_follow_up(question):
+    # Cheap test for a question that cannot be understood without the chat
+    # history. It errs towards True, which only costs the rewrite call.
+    text = question.strip().lower()
+    if not text or text.startswith(('...', '…')):
+        return True
+    words = WORD.findall(text)
+    if len(words) <= 3:
+        return True
+    if any(word in REFERENCES for word in words):
+        return True
+    # "there" as a place ("can I print there?"), not "is there a printer?"
+    for i, word in enumerate(words):
+        if word in ('there', 'here') and (i == 0 or words[i - 1] not in EXISTENTIAL):
+            return True
+    first = ' '.join(words[:2])
+    return any(first == start or first.startswith(start + ' ') for start in FOLLOW_UP_STARTS)
+
+
+class ContextualizationGate:
+    # Decides whether the question is rewritten with the chat history before
+    # retrieval, and counts how often the LLM call is skipped
+    def __init__(self, heuristic=True):
+        self.heuristic = heuristic
+        self.lock = threading.Lock()
+        self.counters = {'no_history': 0, 'standalone': 0, 'rewritten': 0}
+
+    def __call__(self, inputs):
+        if not inputs.get('chat_history'):
+            outcome = 'no_history'
+        elif self.heuristic and not is_follow_up(inputs['input']):
+            outcome = 'standalone'
+        else:
+            outcome = 'rewritten'
+        with self.lock:
+            self.counters[outcome] += 1
+        return outcome == 'rewritten'
+
+    def stats(self):
+        total = sum(self.counters.values())
+        skipped = self.counters['no_history'] + self.counters['standalone']
+        return dict(self.counters, skip_rate=skipped / total if total else 0.0)
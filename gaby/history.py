@@ -0,0 +1,196 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+
+def window_messages(messages, max_messages=20):
+    # The chat history that is put in a prompt: only the most recent turns
+    return list(messages[-max_messages:]) if max_messages > 0 else []
+
+
+class MemoryBackend:
+    def __init__(self, max_sessions=1000, idle_timeout=3600, max_bytes=50_000_000):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _size(messages):
+        return sum(len(json.dumps(m)) for m in messages)
+
+    def _drop(self, session_id):
+        _, messages = self.sessions.pop(session_id)
+        self.size -= self._size(messages)
+
+    def _evict(self, now):
+        # Least recently used sessions sit at the front; the most recent one
+        # is only dropped once it has been idle too long
+        while self.sessions:
+            session_id, (last_seen, _) = next(iter(self.sessions.items()))
+            over_limit = len(self.sessions) > self.max_sessions or self.size > self.max_bytes
+            if last_seen < now - self.idle_timeout or (over_limit and len(self.sessions) > 1):
+                self._drop(session_id)
+            else:
+                break
+
+    def load(self, session_id):
+        with self.lock:
+            now = time.monotonic()
+            self._evict(now)
+            if session_id not in self.sessions:
+                return []
+            _, messages = self.sessions[session_id]
+            self.sessions[session_id] = (now, messages)
+            self.sessions.move_to_end(session_id)
+            return list(messages)
+
+    def append(self, session_id, messages, max_messages):
+        with self.lock:
+            now = time.monotonic()
+            stored = self.sessions.pop(session_id, (now, []))[1]
+            self.size -= self._size(stored)
+            stored = (stored + messages)[-max_messages:]
+            self.sessions[session_id] = (now, stored)
+            self.size += self._size(stored)
+            self._evict(now)
+
+    def clear(self, session_id):
+        with self.lock:
+            if session_id in self.sessions:
+                self._drop(session_id)
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_sessions=10000, idle_timeout=86400):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS sessions "
+                            "(session_id TEXT PRIMARY KEY, last_seen REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS messages "
+                            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, message TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, seq)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def _evict(self, now):
+        stale = [row[0] for row in self.db.execute(
+            "SELECT session_id FROM sessions WHERE last_seen < ? OR session_id NOT IN "
+            "(SELECT session_id FROM sessions ORDER BY last_seen DESC LIMIT ?)",
+            (now - self.idle_timeout, self.max_sessions),
+        )]
+        for session_id in stale:
+            self._delete(session_id)
+
+    def _delete(self, session_id):
+        self.db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def load(self, session_id):
+        with self.lock, self.db:
+            now = time.time()
+            self._evict(now)
+            self.db.execute("UPDATE sessions SET last_seen = ? WHERE session_id = ?", (now, session_id))
+            rows = self.db.execute("SELECT message FROM messages WHERE session_id = ? ORDER BY seq",
+                                   (session_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def append(self, session_id, messages, max_messages):
+        with self.lock, self.db:
+            now = time.time()
+            self.db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session_id, now))
+            self.db.executemany("INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                                [(session_id, json.dumps(m)) for m in messages])
+            self.db.execute(
+                "DELETE FROM messages WHERE session_id = ? AND seq NOT IN "
+                "(SELECT seq FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                (session_id, session_id, max_messages),
+            )
+            self._evict(now)
+
+    def clear(self, session_id):
+        with self.lock, self.db:
+            self._delete(session_id)
+
+
+class RedisBackend:
+    # Idle sessions expire through the key TTL; the overall memory cap is
+    # the server's maxmemory with an LRU eviction policy.
+    def __init__(self, client, idle_timeout=3600, prefix='gaby:history:'):
+        self.client = client
+        self.idle_timeout = idle_timeout
+        self.prefix = prefix
+
+    def load(self, session_id):
+        key = self.prefix + session_id
+        messages = self.client.lrange(key, 0, -1)
+        if messages:
+            self.client.expire(key, self.idle_timeout)
+        return [json.loads(m) for m in messages]
+
+    def append(self, session_id, messages, max_messages):
+        key = self.prefix + session_id
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *[json.dumps(m) for m in messages])
+        pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, self.idle_timeout)
+        pipe.execute()
+
+    def clear(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+class SessionHistory(BaseChatMessageHistory):
+    def __init__(self, backend, session_id, max_messages):
+        self.backend = backend
+        self.session_id = session_id
+        self.max_messages = max_messages
+
+    @property
+    def messages(self):
+        return messages_from_dict(self.backend.load(self.session_id))
+
+    def add_messages(self, messages):
+        self.backend.append(self.session_id, messages_to_dict(messages), self.max_messages)
+
+    def clear(self):
+        self.backend.clear(self.session_id)
+
+
+class SessionStore:
+    def __init__(self, backend, max_messages=20):
+        self.backend = backend
+        self.max_messages = max_messages
+
+    def get_history(self, session_id):
+        return SessionHistory(self.backend, session_id, self.max_messages)
+
+
+def create_session_store(url='memory://', max_messages=20, idle_timeout=3600):
+    # memory://, sqlite:///path/to/sessions.sqlite, redis://host:6379/0, or
+    # fakeredis:// for an in-process Redis stand-in (pip install fakeredis)
+    scheme, _, rest = url.partition('://')
+    if scheme == 'memory':
+        backend = MemoryBackend(idle_timeout=idle_timeout)
+    elif scheme == 'sqlite':
+        # sqlite:///relative.sqlite or sqlite:////absolute.sqlite
+        backend = SQLiteBackend(rest[1:] if rest.startswith('/') else rest,
+                                idle_timeout=idle_timeout)
+    elif scheme == 'redis':
+        import redis
+        backend = RedisBackend(redis.Redis.from_url(url), idle_timeout=idle_timeout)
+    elif scheme == 'fakeredis':
+        import fakeredis
+        backend = RedisBackend(fakeredis.FakeRedis(), idle_timeout=idle_timeout)
+    else:
+        raise ValueError(f"Unknown session store {url!r}")
+    return SessionStore(backend, max_messages=max_messages)
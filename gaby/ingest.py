@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def manifest_path(persist_directory='.chroma'):
+    return os.path.normpath(persist_directory) + '_manifest.json'
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def document_id(document):
+    # The chunk id given by assign_ids, or the content hash for documents
+    # that never went through it
+    return document.metadata.get('chunk_id') or chunk_hash(document.page_content)
+
+
+def assign_ids(documents):
+    # The id is the content hash, so an unchanged chunk keeps its id across
+    # runs. Identical chunks are numbered in file order to stay unique.
+    seen = {}
+    ids = []
+    for document in documents:
+        digest = chunk_hash(document.page_content)
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        chunk_id = digest if count == 0 else f"{digest}-{count}"
+        document.metadata['chunk_id'] = chunk_id
+        ids.append(chunk_id)
+    return ids
+
+
+def generation(chunk_ids, embedding_config):
+    # Changes with the chunks and with the model that embedded them
+    config = json.dumps(embedding_config, sort_keys=True)
+    return chunk_hash('\n'.join([config] + sorted(chunk_ids)))[:16]
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_sync(ids, manifest):
+    known = set(manifest['chunks']) if manifest else set()
+    wanted = set(ids)
+    to_add = [chunk_id for chunk_id in ids if chunk_id not in known]
+    to_delete = sorted(known - wanted)
+    return to_add, to_delete
+
+
+def is_rate_limited(error):
+    return (getattr(error, 'status_code', None) == 429
+            or type(error).__name__ == 'RateLimitError')
+
+
+def embed_with_backoff(embeddings, texts, retries=6, base_delay=1.0):
+    for attempt in range(retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as error:
+            if not is_rate_limited(error) or attempt == retries:
+                raise
+            time.sleep(base_delay * 2 ** attempt + random.uniform(0, base_delay))
+
+
+def reset_collection(store):
+    # An emptied Chroma collection keeps the dimension of its first vectors,
+    # so vectors of another size need the collection dropped and made again
+    if hasattr(store, 'reset_collection'):
+        store.reset_collection()
+        return
+    name, metadata = store._collection.name, store._collection.metadata
+    store.delete_collection()
+    store._collection = store._client.get_or_create_collection(
+        name=name, embedding_function=None, metadata=metadata)
+
+
+def sync_store(store, embeddings, documents, collection_name, path, embedding_config,
+               full=False, batch_size=64, workers=4, progress=None):
+    ids = assign_ids(documents)
+    by_id = dict(zip(ids, documents))
+    manifest = None if full else load_manifest(path)
+    if manifest is not None and manifest.get('embeddings') != embedding_config:
+        # Vectors from another embedding model cannot be mixed with new ones
+        manifest = None
+    to_add, to_delete = plan_sync(ids, manifest)
+
+    if manifest is None:
+        # Without a manifest we cannot tell which stored vectors are ours,
+        # and after a change of embedding model none of them fit, so the
+        # collection starts over instead of duplicating or mixing them.
+        to_delete = store.get(include=[])['ids']
+        reset_collection(store)
+    elif to_delete:
+        store.delete(ids=to_delete)
+
+    # The manifest doubles as the checkpoint: it is rewritten after every
+    # stored batch, so a crashed run resumes with the chunks still missing.
+    stored = {chunk_id: manifest['chunks'][chunk_id] for chunk_id in ids
+              if manifest and chunk_id in manifest['chunks']}
+
+    def checkpoint():
+        save_manifest({
+            'collection': collection_name,
+            'embeddings': embedding_config,
+            'generation': generation(stored, embedding_config),
+            'chunks': stored,
+        }, path)
+
+    checkpoint()
+
+    batches = [to_add[i:i + batch_size] for i in range(0, len(to_add), batch_size)]
+    start = time.perf_counter()
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(embed_with_backoff, embeddings,
+                        [by_id[chunk_id].page_content for chunk_id in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                vectors = future.result()
+            except BaseException:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            # Chroma is only written from this thread
+            store._collection.upsert(
+                ids=batch,
+                embeddings=vectors,
+                documents=[by_id[chunk_id].page_content for chunk_id in batch],
+                metadatas=[by_id[chunk_id].metadata for chunk_id in batch],
+            )
+            for chunk_id in batch:
+                stored[chunk_id] = chunk_hash(by_id[chunk_id].page_content)
+            checkpoint()
+            done += len(batch)
+            if progress:
+                progress(done, len(to_add), done / (time.perf_counter() - start))
+
+    elapsed = time.perf_counter() - start
+    return {
+        'added': len(to_add),
+        'deleted': len(to_delete),
+        'unchanged': len(ids) - len(to_add),
+        'seconds': elapsed,
+        'chunks_per_second': len(to_add) / elapsed if to_add else 0.0,
+    }
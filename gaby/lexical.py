@@ -0,0 +1,177 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+from operator import itemgetter
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from gaby.ingest import document_id, generation, load_manifest, manifest_path
+from gaby.tracing import stage
+
+URL = re.compile(r'https?://\S+')
+TOKEN = re.compile(r'\w+')
+# Only the most frequent words; rare ones such as "ill" or "lb" must stay
+STOPWORDS = frozenset("""
+a an and are as at be by can do for from has have how i if in is it of on or
+the this to what when where which who with you your title link description
+""".split())
+
+
+def lexical_index_path(persist_directory='.chroma'):
+    return os.path.normpath(persist_directory) + '_bm25'
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(URL.sub(' ', text.lower()))
+            if token not in STOPWORDS]
+
+
+def _replace(path, data):
+    with open(path + '.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def build_lexical_index(documents, path, embedding_config, k1=1.5, b=0.75):
+    # Inverted index over the chunks, keyed by their chunk_id. Postings are
+    # (chunk number, term frequency) int32 pairs in postings.bin; each term
+    # maps to its first posting and document frequency in index.json, which
+    # is written last so a reader never sees a half-written index. The
+    # embedding config only goes into the generation, to match the manifest.
+    os.makedirs(path, exist_ok=True)
+    chunk_ids = [document_id(d) for d in documents]
+    postings = {}
+    lengths = array('i')
+    for number, document in enumerate(documents):
+        tokens = tokenize(document.page_content)
+        lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            postings.setdefault(token, []).append((number, count))
+
+    terms = {}
+    flat = array('i')
+    for token in sorted(postings):
+        terms[token] = [len(flat) // 2, len(postings[token])]
+        for number, count in postings[token]:
+            flat.extend((number, count))
+
+    _replace(os.path.join(path, 'postings.bin'), flat.tobytes())
+    _replace(os.path.join(path, 'lengths.bin'), lengths.tobytes())
+    meta = {
+        'generation': generation(chunk_ids, embedding_config),
+        'k1': k1,
+        'b': b,
+        'avgdl': sum(lengths) / len(lengths) if lengths else 0.0,
+        'chunk_ids': chunk_ids,
+        'terms': terms,
+    }
+    _replace(os.path.join(path, 'index.json'), json.dumps(meta).encode('utf-8'))
+    return len(terms)
+
+
+def _map(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b'').cast('i')
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast('i')
+
+
+class LexicalIndex:
+    # BM25 over the index written by build_lexical_index. The postings are
+    # memory-mapped, so loading only parses the term table.
+    def __init__(self, path):
+        with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        self.generation = meta['generation']
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self.avgdl = meta['avgdl'] or 1.0
+        self.chunk_ids = meta['chunk_ids']
+        self.terms = meta['terms']
+        self.postings = _map(os.path.join(path, 'postings.bin'))
+        self.lengths = _map(os.path.join(path, 'lengths.bin'))
+        if len(self.lengths) != len(self.chunk_ids):
+            raise ValueError(f"The lexical index in {path} is incomplete")
+
+    def search(self, query, k=10):
+        n = len(self.chunk_ids)
+        scores = {}
+        for token in set(tokenize(query)):
+            entry = self.terms.get(token)
+            if entry is None:
+                continue
+            start, df = entry
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            postings = self.postings[start * 2:(start + df) * 2]
+            for i in range(0, df * 2, 2):
+                number, tf = postings[i], postings[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[number] / self.avgdl)
+                scores[number] = scores.get(number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [(self.chunk_ids[number], score) for number, score in best]
+
+
+def load_lexical_index(persist_directory='.chroma'):
+    # None when there is no index, or when it was built for another version
+    # of the collection than the one in the manifest
+    path = lexical_index_path(persist_directory)
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        return None
+    index = LexicalIndex(path)
+    manifest = load_manifest(manifest_path(persist_directory)) or {}
+    if index.generation != manifest.get('generation'):
+        return None
+    return index
+
+
+class HybridRetriever(BaseRetriever):
+    # Reciprocal-rank fusion of the vector search and BM25 results
+    vector_store: Any
+    index: Any
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        with stage('embedding'):
+            embedding = self.vector_store.embeddings.embed_query(query)
+        with stage('vector_search'):
+            dense = self.vector_store.similarity_search_by_vector(embedding, k=self.fetch_k)
+        with stage('lexical_search'):
+            lexical = self.index.search(query, k=self.fetch_k)
+
+        scores = {}
+        documents = {}
+        for rank, document in enumerate(dense):
+            chunk_id = document_id(document)
+            documents.setdefault(chunk_id, document)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+
+        best = [chunk_id for chunk_id, _ in
+                heapq.nlargest(self.k, scores.items(), key=itemgetter(1))]
+        missing = [chunk_id for chunk_id in best if chunk_id not in documents]
+        if missing:
+            found = self.vector_store.get(ids=missing)
+            for chunk_id, text, metadata in zip(found['ids'], found['documents'], found['metadatas']):
+                documents[chunk_id] = Document(page_content=text, metadata=metadata or {})
+        return [documents[chunk_id] for chunk_id in best if chunk_id in documents]
+
+
+def hybrid_retriever(vector_store, persist_directory='.chroma', k=3, fetch_k=10):
+    # Falls back to plain vector search until 01_generate_embeddings.py has
+    # built the lexical index
+    index = load_lexical_index(persist_directory)
+    if index is None:
+        return vector_store.as_retriever(search_kwargs={'k': k})
+    return HybridRetriever(vector_store=vector_store, index=index, k=k, fetch_k=fetch_k)
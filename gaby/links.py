@@ -0,0 +1,199 @@
+import csv
+import re
+
+URL_PATTERN = re.compile(r'https?://\S+')
+# Punctuation after a URL that ends the sentence or closes the brackets
+# around it, rather than belonging to it
+URL_TRAILER = re.compile(r'[.,;:!?)\]}>\'"*]+$')
+# What may sit between a title and the URL the model wrote for it
+TITLE_SEPARATOR = r'[ \t:(\[\]–-]{0,4}'
+
+
+def load_links(csvfilename):
+    links = {}
+    with open(csvfilename, 'r', encoding='utf-8') as csvfile:
+        datareader = csv.DictReader(csvfile)
+        for row in datareader:
+            links[row['Title']] = row['Link']
+    return links
+
+
+def normalize_title(title):
+    return ' '.join(title.lower().split())
+
+
+def normalize_url(url):
+    # http and https, a trailing slash and the fragment do not make a
+    # different page
+    url = url.lower().split('#', 1)[0].rstrip('/')
+    return url.split('://', 1)[-1]
+
+
+def split_url(text):
+    trailer = URL_TRAILER.search(text)
+    if trailer is None:
+        return text, ''
+    return text[:trailer.start()], trailer.group(0)
+
+
+def grounded_links(documents):
+    # The links of the chunks retrieved for a turn: the link of each chunk's
+    # record and any URL in its text
+    links = set()
+    for document in documents:
+        link = document.metadata.get('link')
+        if link:
+            links.add(normalize_url(link))
+        for found in URL_PATTERN.finditer(document.page_content):
+            links.add(normalize_url(split_url(found.group(0))[0]))
+    return links
+
+
+def _trie_pattern(words):
+    # Collapse the titles into a prefix trie so the regex engine only follows
+    # branches that share the characters read so far, instead of retrying
+    # every title at every position of the answer.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = []
+        optional = False
+        for char in sorted(node):
+            if char == '':
+                optional = True
+                continue
+            head = r'\s+' if char == ' ' else re.escape(char)
+            branches.append(head + build(node[char]))
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy, so a longer title always wins over one of its prefixes
+        return f'(?:{body})?' if optional else body
+
+    return build(trie)
+
+
+class TitleLinker:
+    # One pattern finds, left to right, both the URLs the model wrote and the
+    # titles of titles_and_links.csv, optionally followed by a URL. A URL is
+    # kept when it is grounded: one of the links of the chunks retrieved for
+    # the turn or of the CSV. Other URLs are dropped. A title gets its link
+    # appended unless that link is already in the answer.
+    def __init__(self, csvall):
+        self.links = {}
+        for title, link in csvall.items():
+            key = normalize_title(title)
+            if key and key not in self.links:
+                self.links[key] = link
+        self.known = {normalize_url(link) for link in self.links.values()}
+        self.max_title_len = max((len(key) for key in self.links), default=0)
+        pattern = r'(?P<url>\(?https?://\S+)'
+        if self.links:
+            pattern += (r'|(?<!\w)(?P<title>' + _trie_pattern(self.links) + r')(?!\w)'
+                        r'(?P<follow>' + TITLE_SEPARATOR + r'https?://\S+)?')
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.follow = re.compile(TITLE_SEPARATOR + r'\Z')
+
+    def _ground(self, text, grounded, seen):
+        url, trailer = split_url(text)
+        key = normalize_url(url.lstrip('('))
+        if key in grounded or key in self.known:
+            seen.add(key)
+            return url + trailer
+        # Keep the end of the sentence, not the brackets of the dropped URL
+        return ''.join(char for char in trailer if char in '.,;:!?')
+
+    def _substitute(self, found, grounded, seen):
+        if found.group('url') is not None:
+            return self._ground(found.group('url'), grounded, seen)
+        title = found.group('title')
+        follow = found.group('follow') or ''
+        separator = follow[:follow.lower().find('http')]
+        if follow:
+            url = follow[len(separator):]
+            key = normalize_url(split_url(url)[0])
+            if key in grounded or key in self.known:
+                seen.add(key)
+                return found.group(0)
+        link = self.links.get(normalize_title(title))
+        text = title
+        if link is not None and normalize_url(link) not in seen:
+            seen.add(normalize_url(link))
+            text = f"{title}: {link}"
+        if follow:
+            # The separator went with the dropped URL
+            text += self._ground(url, grounded, seen)
+        return text
+
+    def __call__(self, answer, grounded=frozenset()):
+        seen = set()
+        return self.pattern.sub(lambda found: self._substitute(found, grounded, seen), answer)
+
+
+def enrich(answer, linker, grounded=frozenset()):
+    # Replaces analyze() of the chat scripts, which dropped every URL the
+    # model wrote and then linked the titles it mentions
+    return linker(answer, grounded)
+
+
+class StreamEnricher:
+    # enrich() for an answer that arrives in pieces. Text is only released
+    # once no URL or title can still extend into it, so the concatenated
+    # output is exactly enrich() of the whole answer.
+    LAST_SPACE = re.compile(r'\s\S*\Z')
+
+    def __init__(self, linker, grounded=frozenset()):
+        self.linker = linker
+        self.grounded = grounded
+        self.seen = set()
+        self.raw = ''
+        self.text = ''
+        self.before = ''
+
+    def feed(self, piece):
+        # Whole words only, so every URL in self.text is complete
+        self.raw += piece
+        space = self.LAST_SPACE.search(self.raw)
+        if space:
+            end = space.start() + 1
+            self.text += self.raw[:end]
+            self.raw = self.raw[end:]
+        return self._link(final=False)
+
+    def flush(self):
+        self.text += self.raw
+        self.raw = ''
+        return self._link(final=True)
+
+    def _link(self, final):
+        # Keep the last released character in front for the lookbehind
+        text = self.before + self.text
+        start = len(self.before)
+        limit = len(text) if final else len(text) - self.linker.max_title_len - 1
+        if limit <= start:
+            return ''
+        output = []
+        pos = start
+        for found in self.linker.pattern.finditer(text, start):
+            if found.start() >= limit:
+                break
+            if (not final and found.group('title') is not None and not found.group('follow')
+                    and self.linker.follow.match(text, found.end())):
+                # The URL of this title may still be on its way
+                limit = found.start()
+                break
+            output.append(text[pos:found.start()])
+            output.append(self.linker._substitute(found, self.grounded, self.seen))
+            pos = found.end()
+        cut = max(pos, limit)
+        if cut <= start:
+            return ''.join(output)
+        output.append(text[pos:cut])
+        self.before = text[cut - 1]
+        self.text = text[cut:]
+        return ''.join(output)
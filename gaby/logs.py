@@ -0,0 +1,203 @@
+# Conversation logs, written in batches by one thread per process to
+# append-only JSONL files partitioned by day:
+#
+#   logs/date=2026-10-18/conversations-<host>-<pid>.jsonl
+#
+# One file per process, so API workers never interleave their lines. Each
+# line is one message: {"timestamp", "backend", "session_id", "role",
+# "content", "latency_ms", "first_token_ms", "tokens", "cached", "stages",
+# "prompt_tokens", "completion_tokens"}; the last seven are only set on
+# assistant messages. "tokens" is the prompt budget of the answer call,
+# prompt_tokens and completion_tokens the sums over all its LLM calls.
+#
+# To convert the per-session CSVs of the earlier logs_<backend> folders:
+#
+#   python -m gaby.logs convert logs_gemini logs_openai logs_phi3 --output logs
+import argparse
+import atexit
+import csv
+import glob
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LOG_FIELDS = ('timestamp', 'backend', 'session_id', 'role', 'content',
+              'latency_ms', 'first_token_ms', 'tokens', 'cached', 'stages',
+              'prompt_tokens', 'completion_tokens')
+
+
+def log_record(backend, session_id, role, content, **extra):
+    record = dict.fromkeys(LOG_FIELDS)
+    record.update(timestamp=datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                  backend=backend, session_id=session_id, role=role, content=content, **extra)
+    return record
+
+
+def partition_path(directory, day, name):
+    return os.path.join(directory, f'date={day}', f'{name}.jsonl')
+
+
+class ConversationLog:
+    # log() only puts the record on a queue. The writer thread takes up to
+    # batch_size records at a time, or what arrived within flush_interval
+    # seconds, and appends them with one write. Records are dropped, and
+    # counted, when the queue is full rather than blocking a request.
+    def __init__(self, directory='logs', batch_size=256, flush_interval=1.0, max_queue=100000):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = f'conversations-{socket.gethostname()}-{os.getpid()}'
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.counters = {'logged': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'errors': 0}
+        self.file = None
+        self.day = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='gaby-log-writer', daemon=True)
+        self.thread.start()
+
+    def log(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.counters['logged'] += 1
+        except queue.Full:
+            self.counters['dropped'] += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                batch.append(record)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        # A batch is written to the partition of its first record's day
+        try:
+            day = batch[0]['timestamp'][:10]
+            if day != self.day:
+                if self.file is not None:
+                    self.file.close()
+                path = partition_path(self.directory, day, self.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.file = open(path, 'a', encoding='utf-8')
+                self.day = day
+            self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch))
+            self.file.flush()
+            self.counters['written'] += len(batch)
+            self.counters['batches'] += 1
+        except (OSError, TypeError, ValueError):
+            self.counters['errors'] += 1
+            logger.exception("Writing the conversation log failed")
+
+    def close(self):
+        # Writes what is still queued; called at exit
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return dict(self.counters, queued=self.queue.qsize())
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def conversation_log():
+    # One writer per process; GABY_LOG_DIRECTORY moves the logs
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = ConversationLog(os.environ.get('GABY_LOG_DIRECTORY', 'logs'))
+            atexit.register(_log.close)
+        return _log
+
+
+def read_log(directory='logs'):
+    for filename in sorted(glob.glob(os.path.join(directory, 'date=*', '*.jsonl'))):
+        with open(filename, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def session_start(session_id, filename):
+    # The pages name sessions after their start time; older logs only have
+    # the file's modification time
+    try:
+        started = datetime.strptime(session_id, '%Y%m%d%H%M%S')
+    except ValueError:
+        started = datetime.fromtimestamp(os.path.getmtime(filename))
+    return started.astimezone(timezone.utc)
+
+
+def convert_csv_logs(directories, output='logs'):
+    # Rows of logs_<backend>/conversation_<session_id>.csv become records of
+    # that backend. The CSVs have no times: the messages of a session get the
+    # session's start time, one millisecond apart, to keep their order.
+    records = {}
+    for directory in directories:
+        backend = os.path.basename(os.path.normpath(directory)).removeprefix('logs_')
+        for filename in sorted(glob.glob(os.path.join(directory, 'conversation_*.csv'))):
+            session_id = os.path.basename(filename)[len('conversation_'):-len('.csv')]
+            started = session_start(session_id, filename).timestamp()
+            with open(filename, 'r', newline='', encoding='utf-8') as file:
+                rows = [row for row in csv.reader(file) if len(row) >= 2]
+            for number, (role, content, *_) in enumerate(rows):
+                timestamp = datetime.fromtimestamp(started + number / 1000, timezone.utc)
+                record = dict.fromkeys(LOG_FIELDS)
+                record.update(timestamp=timestamp.isoformat(timespec='milliseconds'),
+                              backend=backend, session_id=session_id, role=role, content=content)
+                records.setdefault((record['timestamp'][:10], backend), []).append(record)
+    # One file per day and backend, replaced when converting again
+    for (day, backend), part in sorted(records.items()):
+        path = partition_path(output, day, f'converted-{backend}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in part))
+    return sum(len(part) for part in records.values()), len({day for day, _ in records})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert logs_<backend> CSV folders')
+    convert.add_argument('directories', nargs='+')
+    convert.add_argument('--output', default='logs')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        count, days = convert_csv_logs(args.directories, args.output)
+        print(f"{count} messages over {days} days written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
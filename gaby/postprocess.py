@@ -0,0 +1,60 @@
+import os
+import re
+
+# What the grammar-rewrite call used to enforce, asked for up front instead
+FORMATTING_RULES = (
+    "Write in clear, grammatically correct, complete sentences. "
+    "If there is a list, use bullet points. "
+    "Do not start your answer with a speaker label such as \"Gaby:\" or \"AI:\"."
+)
+
+REWRITE_PROMPT = (
+    "Rewrite this to be more grammatically correct. Use clearer language, and remove "
+    "incomplete sentences. Do not add new links to the response. Do not remove links "
+    "from the response. If there is a list, use bullet points."
+)
+
+# A speaker label at the start of a line, or right after a sentence
+SPEAKER_PREFIX = re.compile(
+    r'(?:^[ \t]*|(?<=[.!?])(?P<gap>[ \t]+))(?:\*\*)?(?:Gaby|AI|System|Assistant)(?:\*\*)?:[ \t]*',
+    re.IGNORECASE | re.MULTILINE,
+)
+BULLET = re.compile(r'^([ \t]*)(?:[*•+‣◦▪–]|-(?!-))[ \t]+', re.MULTILINE)
+
+
+def single_pass_enabled():
+    return os.environ.get('GABY_ANSWER_MODE', 'rewrite') == 'single-pass'
+
+
+def add_formatting_rules(system_prompt):
+    # Keep the retrieved context last when the prompt ends with it
+    stripped = system_prompt.rstrip()
+    if stripped.endswith('{context}'):
+        head = stripped[:-len('{context}')].rstrip()
+        return f"{head}\n{FORMATTING_RULES}\n\n{{context}}"
+    return f"{stripped}\n{FORMATTING_RULES}\n"
+
+
+def remove_extra_prefixes(response):
+    return SPEAKER_PREFIX.sub(lambda found: ' ' if found.group('gap') else '', response)
+
+
+def clean_urls(answer):
+    return re.sub(r'[\[\]()]', ' ', answer)
+
+
+def normalize_bullets(answer):
+    lines = BULLET.sub(r'\1- ', answer).split('\n')
+    # Markdown needs a blank line between a paragraph and the list after it
+    result = []
+    for line in lines:
+        is_item = line.lstrip().startswith('- ')
+        if is_item and result and result[-1].strip() and not result[-1].lstrip().startswith('- '):
+            result.append('')
+        result.append(line)
+    return '\n'.join(result)
+
+
+def postprocess(answer):
+    answer = normalize_bullets(remove_extra_prefixes(answer.strip()))
+    return re.sub(r'\n{3,}', '\n\n', answer).strip()
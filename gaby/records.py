@@ -0,0 +1,79 @@
+import re
+
+from langchain_core.documents import Document
+
+URL_LINE = re.compile(r'^\s*https?://\S+\s*$')
+
+
+def _record(title='', description=None, link=''):
+    return {'title': title, 'description': description or [], 'link': link}
+
+
+def _finish(record):
+    return {
+        'title': record['title'],
+        'description': '\n'.join(record['description']).strip(),
+        'link': record['link'],
+    }
+
+
+def iter_records(lines):
+    # gabysknowledge_final.txt is a sequence of
+    #   title: ...
+    #   description: ... (any number of lines)
+    #   link: ...
+    # records. A handful of links sit on the line after an empty "link:",
+    # and text found after a link without a new title becomes its own record.
+    record = None
+    field = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('title:'):
+            if record is not None:
+                yield _finish(record)
+            record = _record(title=line[len('title:'):].strip())
+            field = 'title'
+        elif record is None:
+            if line.strip():
+                record = _record(description=[line])
+                field = 'description'
+        elif field == 'title' and line.startswith('description:'):
+            record['description'].append(line[len('description:'):].strip())
+            field = 'description'
+        elif field != 'link' and line.startswith('link:'):
+            record['link'] = line[len('link:'):].strip()
+            field = 'link'
+        elif field == 'link':
+            if not line.strip():
+                continue
+            if not record['link'] and URL_LINE.match(line):
+                record['link'] = line.strip()
+            else:
+                yield _finish(record)
+                record = _record(description=[line])
+                field = 'description'
+        else:
+            record['description'].append(line)
+    if record is not None:
+        yield _finish(record)
+
+
+def record_documents(records, text_splitter):
+    # Every chunk repeats its record's title and link so it stands on its
+    # own in the prompt; both are also kept as metadata.
+    for record in records:
+        if not record['description'] and not record['title']:
+            continue
+        pieces = text_splitter.split_text(record['description']) or ['']
+        for piece in pieces:
+            lines = []
+            if record['title']:
+                lines.append(f"title: {record['title']}")
+            if piece:
+                lines.append(piece)
+            if record['link']:
+                lines.append(f"link: {record['link']}")
+            yield Document(
+                page_content='\n'.join(lines),
+                metadata={'title': record['title'], 'link': record['link']},
+            )
@@ -0,0 +1,251 @@
+# A rerank stage between retrieval and the prompt: the retriever fetches a
+# wider set of candidates, the reranker scores them against the question
+# and only the best few are stuffed into the prompt.
+#
+#   GABY_RERANK=cross-encoder[:model]   a small CPU cross-encoder, needs
+#                                       pip install sentence-transformers
+#   GABY_RERANK=mmr[:lambda]            maximal marginal relevance over the
+#                                       stored vectors, no extra dependency
+#
+# Scores are computed in batches and cached by (question, chunk id). When
+# scoring runs over GABY_RERANK_BUDGET_MS, or the model is still loading,
+# the candidates keep the retriever's order.
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from gaby.cache import TTLCache
+from gaby.ingest import document_id
+from gaby.tracing import stage
+
+DEFAULT_CROSS_ENCODER = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+logger = logging.getLogger(__name__)
+
+# Scoring runs here, so a question waits for it at most the budget. Scoring
+# that overran still finishes in the background and fills the score cache.
+_scoring = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='gaby-rerank')
+
+
+class Reranker:
+    # Keeps the best k of the candidates by score(); subclasses score a batch
+    # of documents against the question, and may select differently
+    def __init__(self, k=3, budget_ms=150, batch_size=16, maxsize=8192, ttl=3600, max_pending=4):
+        self.k = k
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.pending = 0
+        self.scores = TTLCache(maxsize, ttl)
+        self.lock = threading.Lock()
+        self.counters = {'reranked': 0, 'fallbacks': 0, 'loading': 0, 'timeouts': 0, 'busy': 0,
+                         'errors': 0, 'scored': 0, 'cached': 0}
+
+    def ready(self):
+        return True
+
+    def wait(self, timeout=None):
+        # For benchmarks, which should not time the model loading
+        return self.ready()
+
+    def score(self, query, documents):
+        raise NotImplementedError
+
+    def select(self, query, documents, scores):
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        return order[:self.k]
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _score_missing(self, query, missing):
+        try:
+            scores = {}
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                for (chunk_id, _), score in zip(batch, self.score(query, [d for _, d in batch])):
+                    scores[chunk_id] = float(score)
+                    self.scores.set((query, chunk_id), float(score))
+                self._count('scored', len(batch))
+            return scores
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _fallback(self, documents, reason):
+        self._count(reason)
+        self._count('fallbacks')
+        return documents[:self.k]
+
+    def rank(self, query, documents):
+        if len(documents) <= self.k:
+            return documents
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        if not self.ready():
+            return self._fallback(documents, 'loading')
+        ids = [document_id(document) for document in documents]
+        scores = {}
+        missing = []
+        for chunk_id, document in zip(ids, documents):
+            score = self.scores.get((query, chunk_id))
+            if score is None:
+                missing.append((chunk_id, document))
+            else:
+                scores[chunk_id] = score
+        self._count('cached', len(scores))
+        if missing:
+            with self.lock:
+                # Scoring that cannot keep up would only queue more of it
+                busy = self.pending >= self.max_pending
+                if not busy:
+                    self.pending += 1
+            if busy:
+                return self._fallback(documents, 'busy')
+            future = _scoring.submit(self._score_missing, query, missing)
+        try:
+            if missing:
+                scores.update(future.result(timeout=max(deadline - time.perf_counter(), 0)))
+            order = self.select(query, documents, [scores[i] for i in ids])
+        except concurrent.futures.TimeoutError:
+            return self._fallback(documents, 'timeouts')
+        except Exception:
+            logger.exception("Reranking failed")
+            return self._fallback(documents, 'errors')
+        self._count('reranked')
+        return [documents[i] for i in order]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=self.pending)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _cross_encoder(model):
+    # One model per process, shared by the cores of all backends
+    with _models_lock:
+        if model not in _models:
+            from sentence_transformers import CrossEncoder
+            _models[model] = CrossEncoder(model, device='cpu')
+        return _models[model]
+
+
+class CrossEncoderReranker(Reranker):
+    # The model is loaded in the background; until it is, questions fall back
+    # to the retriever's order instead of waiting for it
+    def __init__(self, model=DEFAULT_CROSS_ENCODER, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model
+        self.model = None
+        self.loaded = threading.Event()
+        threading.Thread(target=self._load, name='gaby-rerank-load', daemon=True).start()
+
+    def _load(self):
+        try:
+            self.model = _cross_encoder(self.model_name)
+        except Exception:
+            logger.exception("Loading the rerank model %s failed", self.model_name)
+        finally:
+            self.loaded.set()
+
+    def ready(self):
+        return self.model is not None
+
+    def wait(self, timeout=None):
+        self.loaded.wait(timeout)
+        return self.ready()
+
+    def score(self, query, documents):
+        pairs = [(query, document.page_content) for document in documents]
+        return self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+
+class MMRReranker(Reranker):
+    # Relevance is the cosine similarity of the question and chunk vectors;
+    # select() then trades it against the similarity to the chunks already
+    # picked, so near-duplicate chunks do not fill the prompt
+    def __init__(self, vector_store, lambda_mult=0.7, **kwargs):
+        super().__init__(**kwargs)
+        self.vector_store = vector_store
+        self.lambda_mult = lambda_mult
+        self.vectors = TTLCache(kwargs.get('maxsize', 8192), kwargs.get('ttl', 3600))
+
+    def _vectors(self, documents, fetch=True):
+        ids = [document_id(document) for document in documents]
+        missing = [chunk_id for chunk_id in ids if self.vectors.get(chunk_id) is None]
+        if missing and fetch:
+            found = self.vector_store.get(ids=missing, include=['embeddings'])
+            for chunk_id, vector in zip(found['ids'], found['embeddings']):
+                vector = np.asarray(vector, dtype=np.float32)
+                self.vectors.set(chunk_id, vector / (np.linalg.norm(vector) or 1.0))
+        dimensions = None
+        rows = []
+        for chunk_id in ids:
+            vector = self.vectors.get(chunk_id)
+            rows.append(vector)
+            if vector is not None:
+                dimensions = len(vector)
+        # Chunks missing from the store get a zero vector
+        return np.stack([row if row is not None else np.zeros(dimensions or 1, np.float32)
+                         for row in rows])
+
+    def _query(self, query):
+        vector = np.asarray(self.vector_store.embeddings.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def score(self, query, documents):
+        return self._vectors(documents) @ self._query(query)
+
+    def select(self, query, documents, scores):
+        # The vectors score() fetched within the budget; select() runs after
+        # it, so it never looks up the store
+        vectors = self._vectors(documents, fetch=False)
+        similarity = vectors @ vectors.T
+        relevance = np.asarray(scores)
+        chosen = [int(np.argmax(relevance))]
+        while len(chosen) < min(self.k, len(documents)):
+            redundancy = similarity[:, chosen].max(axis=1)
+            value = self.lambda_mult * relevance - (1 - self.lambda_mult) * redundancy
+            value[chosen] = -np.inf
+            chosen.append(int(np.argmax(value)))
+        return chosen
+
+
+def create_reranker(value, vector_store, k=3, budget_ms=150, batch_size=16):
+    # None for "" or "off"; see the top of this file for the values
+    name, _, option = (value or '').partition(':')
+    name = name.strip()
+    if name in ('', 'off'):
+        return None
+    if name == 'cross-encoder':
+        return CrossEncoderReranker(option.strip() or DEFAULT_CROSS_ENCODER, k=k, budget_ms=budget_ms,
+                                    batch_size=batch_size)
+    if name == 'mmr':
+        return MMRReranker(vector_store, float(option or 0.7), k=k, budget_ms=budget_ms,
+                           batch_size=batch_size)
+    raise ValueError(f"Unknown reranker {name!r}, expected cross-encoder or mmr")
+
+
+def reranker_from_env(vector_store):
+    return create_reranker(os.environ.get('GABY_RERANK'), vector_store,
+                           k=int(os.environ.get('GABY_RERANK_TOP', 3)),
+                           budget_ms=float(os.environ.get('GABY_RERANK_BUDGET_MS', 150)))
+
+
+class RerankRetriever(BaseRetriever):
+    retriever: BaseRetriever
+    reranker: Any
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        documents = self.retriever.invoke(query, config={'callbacks': run_manager.get_child()})
+        with stage('rerank'):
+            return self.reranker.rank(query, documents)
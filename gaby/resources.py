@@ -0,0 +1,16 @@
+import os
+
+from gaby.ingest import manifest_path
+
+
+def file_version(path):
+    # Passed to st.cache_resource loaders so an edited file is picked up on
+    # the next rerun without restarting the server
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def index_version(persist_directory='.chroma'):
+    return file_version(manifest_path(persist_directory))
@@ -0,0 +1,201 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Requests in flight per LLM backend. The hosted APIs take many at once;
+# a local Ollama model answers one or two at a time and only queues the rest.
+DEFAULT_CONCURRENCY = {
+    'openai': 16,
+    'gemini': 16,
+    'phi3': 2,
+    'llama3': 2,
+}
+
+TIMEOUT_MESSAGE = ("Sorry, I am taking too long to answer right now. "
+                   "Please try again in a moment.")
+ERROR_MESSAGE = ("Sorry, something went wrong while answering. "
+                 "Please try again in a moment.")
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def serving_loop():
+    # One event loop per process, on its own thread. Streamlit runs every
+    # session's script in a separate thread; they all hand their requests to
+    # this loop, so a slow answer only holds a coroutine, not a thread.
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='gaby-serving', daemon=True).start()
+        return _loop
+
+
+def iterate_in_loop(items):
+    # Synchronous view of an async iterator run on the serving loop, for the
+    # Streamlit script thread. When the caller stops iterating (the user left
+    # or sent a new message, and Streamlit stopped the script), the work on
+    # the loop is cancelled.
+    results = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in items:
+                results.put(item)
+        except BaseException as error:
+            results.put(error)
+            raise
+        finally:
+            results.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), serving_loop())
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                if isinstance(item, asyncio.CancelledError):
+                    break
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gaby-writer')
+
+
+def in_background(function, *args, **kwargs):
+    # Blocking writes (conversation logs, feedback) run one at a time, in
+    # order, off the script thread
+    return _writer.submit(function, *args, **kwargs)
+
+
+class ServingCore:
+    # Runs chains with ainvoke/astream under a per-request timeout and a
+    # limit on concurrent requests to one backend. An instance belongs to the
+    # event loop it is first used on; get shared ones from serving_core().
+    def __init__(self, backend, max_concurrency=None, timeout=60.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency or DEFAULT_CONCURRENCY.get(backend, 8)
+        self.timeout = timeout
+        self.semaphore = None
+        self.counters = {'requests': 0, 'active': 0, 'waiting': 0,
+                         'completed': 0, 'timeouts': 0, 'cancelled': 0, 'errors': 0}
+
+    def _semaphore(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphore
+
+    async def _acquire(self, deadline):
+        loop = asyncio.get_running_loop()
+        self.counters['requests'] += 1
+        self.counters['waiting'] += 1
+        try:
+            await asyncio.wait_for(self._semaphore().acquire(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise TimeoutError(f"No {self.backend} slot free within {self.timeout}s")
+        finally:
+            self.counters['waiting'] -= 1
+        self.counters['active'] += 1
+
+    def _release(self, outcome):
+        self.counters['active'] -= 1
+        self.counters[outcome] += 1
+        self.semaphore.release()
+
+    async def ainvoke(self, runnable, inputs, config=None):
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        await self._acquire(deadline)
+        outcome = 'errors'
+        try:
+            result = await asyncio.wait_for(runnable.ainvoke(inputs, config=config),
+                                            max(deadline - asyncio.get_running_loop().time(), 0))
+            outcome = 'completed'
+            return result
+        except asyncio.TimeoutError:
+            outcome = 'timeouts'
+            raise TimeoutError(f"{self.backend} request took longer than {self.timeout}s")
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            self._release(outcome)
+
+    async def astream(self, runnable, inputs, config=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        await self._acquire(deadline)
+        outcome = 'errors'
+        chunks = runnable.astream(inputs, config=config)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(),
+                                                   max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                yield chunk
+            outcome = 'completed'
+        except asyncio.TimeoutError:
+            outcome = 'timeouts'
+            raise TimeoutError(f"{self.backend} request took longer than {self.timeout}s")
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = 'cancelled'
+            raise
+        finally:
+            self._release(outcome)
+            await chunks.aclose()
+
+    def invoke(self, runnable, inputs, config=None):
+        future = asyncio.run_coroutine_threadsafe(self.ainvoke(runnable, inputs, config),
+                                                  serving_loop())
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    def stream(self, runnable, inputs, config=None):
+        return iterate_in_loop(self.astream(runnable, inputs, config))
+
+    def wrap(self, runnable):
+        return ServedRunnable(self, runnable)
+
+    def stats(self):
+        return dict(self.counters, backend=self.backend, max_concurrency=self.max_concurrency)
+
+
+class ServedRunnable:
+    # A runnable whose invoke and stream go through a ServingCore
+    def __init__(self, core, runnable):
+        self.core = core
+        self.runnable = runnable
+
+    def invoke(self, inputs, config=None):
+        return self.core.invoke(self.runnable, inputs, config)
+
+    def stream(self, inputs, config=None):
+        return self.core.stream(self.runnable, inputs, config)
+
+    async def ainvoke(self, inputs, config=None):
+        return await self.core.ainvoke(self.runnable, inputs, config)
+
+    def astream(self, inputs, config=None):
+        return self.core.astream(self.runnable, inputs, config)
+
+
+_cores = {}
+
+
+def serving_core(backend, max_concurrency=None, timeout=60.0):
+    # Shared by every session of the process, so the limit is per backend
+    with _loop_lock:
+        if backend not in _cores:
+            _cores[backend] = ServingCore(backend, max_concurrency, timeout)
+        return _cores[backend]
@@ -0,0 +1,217 @@
+# Per-request stage timings and token counts.
+#
+# A Trace is started for every answer and made current for the task that
+# runs it. Code deep in the pipeline (retrievers, caches) times itself with
+# stage(); the LLM calls and the retriever run are timed by TraceCallback
+# from the LangChain callbacks, and named after the stage tag of the chain
+# they run in. Finished traces go to the conversation log, to the "done"
+# event and to the process-wide Prometheus metrics.
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from gaby.context import count_tokens
+
+# In pipeline order; "retrieval" includes the retrieval cache and the
+# embedding, search and rerank stages under it
+STAGES = ('contextualize', 'retrieval', 'embedding', 'vector_search', 'lexical_search', 'rerank',
+          'answer_cache', 'generation', 'enrichment', 'rewrite', 'logging')
+LLM_STAGES = ('contextualize', 'generation', 'rewrite')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current = contextvars.ContextVar('gaby_trace', default=None)
+
+
+class Trace:
+    def __init__(self, backend):
+        self.backend = backend
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+        self.tokens = {}
+        self.chunks = 0
+        self.cached = False
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add_tokens(self, name, prompt, completion):
+        counts = self.tokens.setdefault(name, {'prompt': 0, 'completion': 0})
+        counts['prompt'] += prompt
+        counts['completion'] += completion
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        end = self.finished or time.perf_counter()
+        return {
+            'total_ms': round((end - self.started) * 1000, 1),
+            'stages_ms': {name: round(self.stages[name] * 1000, 1)
+                          for name in STAGES if name in self.stages},
+            'prompt_tokens': sum(counts['prompt'] for counts in self.tokens.values()),
+            'completion_tokens': sum(counts['completion'] for counts in self.tokens.values()),
+            'chunks': self.chunks,
+        }
+
+
+def start_trace(backend):
+    trace = Trace(backend)
+    _current.set(trace)
+    return trace
+
+
+@contextmanager
+def stage(name):
+    # Times the block into the current trace, if there is one
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def _stage_of(tags):
+    for tag in tags or ():
+        if tag in LLM_STAGES:
+            return tag
+    return None
+
+
+class TraceCallback(BaseCallbackHandler):
+    # Times LLM calls by the stage tag of their chain (see
+    # create_rag_chain), and the retriever run as "retrieval". Token counts
+    # come from the provider when it reports them, and are counted locally
+    # otherwise (streamed OpenAI answers do not report usage).
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.runs = {}
+        self.nested = set()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        text = "\n".join(str(message.content) for batch in messages for message in batch)
+        self.runs[run_id] = (_stage_of(tags) or 'generation', time.perf_counter(), count_tokens(text))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self.runs[run_id] = (_stage_of(tags) or 'generation', time.perf_counter(),
+                             count_tokens("\n".join(prompts)))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self.runs:
+            return
+        name, start, prompt = self.runs.pop(run_id)
+        self.trace.add(name, time.perf_counter() - start)
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        completion = usage.get('completion_tokens')
+        if completion is None:
+            completion = sum(count_tokens(generation.text)
+                             for generations in response.generations for generation in generations)
+        self.trace.add_tokens(name, usage.get('prompt_tokens') or prompt, completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.runs.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        # Only the outer retriever: the rerank and cached retrievers wrap others
+        if parent_run_id in self.nested or (parent_run_id in self.runs
+                                            and self.runs[parent_run_id][0] == 'retrieval'):
+            self.nested.add(run_id)
+            return
+        self.runs[run_id] = ('retrieval', time.perf_counter(), 0)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.nested.discard(run_id)
+        if run_id in self.runs:
+            name, start, _ = self.runs.pop(run_id)
+            self.trace.add(name, time.perf_counter() - start)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.nested.discard(run_id)
+        self.runs.pop(run_id, None)
+
+
+class Metrics:
+    # Prometheus histograms and counters over the finished traces of this
+    # process, rendered in the text exposition format
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][position] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    def _increment(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, trace):
+        backend = ('backend', trace.backend)
+        with self.lock:
+            self._observe('gaby_request_seconds', (backend,), trace.finished - trace.started)
+            for name, seconds in trace.stages.items():
+                self._observe('gaby_stage_seconds', (backend, ('stage', name)), seconds)
+            for name, counts in trace.tokens.items():
+                for kind, value in counts.items():
+                    self._increment('gaby_llm_tokens_total',
+                                    (backend, ('stage', name), ('kind', kind)), value)
+            self._increment('gaby_requests_total',
+                            (backend, ('cached', 'true' if trace.cached else 'false')))
+            self._increment('gaby_retrieved_chunks_total', (backend,), trace.chunks)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {metric} histogram")
+                for (name, labels), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram['buckets']):
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+            for metric in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {metric} counter")
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == metric:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Replaced in one step, for the node_exporter textfile collector
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
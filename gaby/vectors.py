@@ -0,0 +1,256 @@
+import json
+import mmap
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from gaby.ingest import generation, load_manifest, manifest_path
+
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+# Rows converted at a time when the matrix is not float32
+BLOCK_ROWS = 1024
+# int8 search ranks this many times k candidates again with the float32 rows
+RESCORE = 4
+
+
+def dense_index_path(persist_directory='.chroma'):
+    return os.path.normpath(persist_directory) + '_vectors'
+
+
+def _write(path, array):
+    with open(path + '.tmp', 'wb') as file:
+        array.tofile(file)
+    os.replace(path + '.tmp', path)
+
+
+def write_dense_index(path, ids, vectors, texts, metadatas, embedding_config, dtype='float32'):
+    # The vectors as one contiguous row-major matrix in vectors.bin, their
+    # squared norms in norms.bin, and the chunk texts in texts.bin with their
+    # byte offsets in offsets.bin. index.json holds the chunk ids and
+    # metadata and is written last, so a reader never sees a half-written
+    # index.
+    #
+    # int8 stores each row scaled to -127..127 with its scale in scales.bin,
+    # a quarter of float32, and keeps the float32 rows in rescore.bin: only
+    # the rows of the best candidates are read from it, to rank them exactly.
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+    os.makedirs(path, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(ids):
+        vectors = vectors.reshape(0, 0)
+    texts = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+
+    if dtype == 'int8':
+        scales = (np.abs(vectors).max(axis=1, initial=0.0) / 127).astype(np.float32)
+        scales[scales == 0] = 1.0
+        matrix = np.round(vectors / scales[:, None]).astype(np.int8)
+        _write(os.path.join(path, 'scales.bin'), scales)
+        _write(os.path.join(path, 'rescore.bin'), vectors)
+        norms = np.einsum('ij,ij->i', vectors, vectors)
+    else:
+        matrix = vectors.astype(dtype)
+        # Norms of the stored rows, so float16 rounding does not skew distances
+        stored = matrix.astype(np.float32)
+        norms = np.einsum('ij,ij->i', stored, stored)
+    _write(os.path.join(path, 'vectors.bin'), matrix)
+    _write(os.path.join(path, 'norms.bin'), norms.astype(np.float32))
+    _write(os.path.join(path, 'offsets.bin'), offsets)
+    with open(os.path.join(path, 'texts.bin.tmp'), 'wb') as file:
+        file.write(b''.join(texts))
+    os.replace(os.path.join(path, 'texts.bin.tmp'), os.path.join(path, 'texts.bin'))
+    meta = {
+        'generation': generation(ids, embedding_config),
+        'dtype': dtype,
+        'dimensions': int(vectors.shape[1]),
+        'chunk_ids': list(ids),
+        'metadatas': [metadata or {} for metadata in metadatas],
+    }
+    with open(os.path.join(path, 'index.json.tmp'), 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+    os.replace(os.path.join(path, 'index.json.tmp'), os.path.join(path, 'index.json'))
+    if dtype != 'int8':
+        # Left by an earlier int8 export, and no longer read
+        for name in ('scales.bin', 'rescore.bin'):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+    return matrix.nbytes
+
+
+def export_dense_index(store, path, embedding_config, dtype='float32'):
+    # The vectors of a Chroma collection; returns the size of the matrix
+    stored = store.get(include=['embeddings', 'documents', 'metadatas'])
+    return write_dense_index(path, stored['ids'], stored['embeddings'], stored['documents'],
+                             stored['metadatas'], embedding_config, dtype)
+
+
+def disk_size(path):
+    # Every file of an export, including the float32 rows kept for int8
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _map(path, dtype, shape=None):
+    # Read-only mappings of the same file share their pages between processes
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape or 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def _smallest(values, k):
+    k = min(k, len(values))
+    return np.argpartition(values, k - 1)[:k]
+
+
+class DenseIndex:
+    # Exact nearest-neighbour search over the memory-mapped matrix written by
+    # write_dense_index, by squared L2 distance like the Chroma collection.
+    # An int8 matrix is searched approximately, then its best rescore * k
+    # candidates exactly; rescore=0 returns the approximate ranking.
+    def __init__(self, path, rescore=RESCORE):
+        with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        self.generation = meta['generation']
+        self.chunk_ids = meta['chunk_ids']
+        self.metadatas = meta['metadatas']
+        self.numbers = {chunk_id: number for number, chunk_id in enumerate(self.chunk_ids)}
+        shape = (len(self.chunk_ids), meta['dimensions'])
+        self.vectors = _map(os.path.join(path, 'vectors.bin'), meta['dtype'], shape)
+        self.norms = _map(os.path.join(path, 'norms.bin'), np.float32)
+        self.offsets = _map(os.path.join(path, 'offsets.bin'), np.int64)
+        self.scales = None
+        self.full = None
+        self.rescore = rescore
+        if meta['dtype'] == 'int8':
+            self.scales = _map(os.path.join(path, 'scales.bin'), np.float32)
+            # Read row by row rather than mapped, so the few rows read per
+            # query do not map the pages around them into every worker
+            self.full = os.open(os.path.join(path, 'rescore.bin'), os.O_RDONLY)
+        with open(os.path.join(path, 'texts.bin'), 'rb') as file:
+            self.texts = (mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                          if os.fstat(file.fileno()).st_size else b'')
+        if len(self.norms) != len(self.chunk_ids) or len(self.offsets) != len(self.chunk_ids) + 1:
+            raise ValueError(f"The vector index in {path} is incomplete")
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def close(self):
+        # Closes the rescore file and the text mapping; the matrix mappings
+        # go with the last reference to them
+        if self.full is not None:
+            os.close(self.full)
+            self.full = None
+        if isinstance(self.texts, mmap.mmap):
+            self.texts.close()
+
+    def dot(self, query):
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        scores = np.concatenate([self.vectors[start:start + BLOCK_ROWS].astype(np.float32) @ query
+                                 for start in range(0, len(self), BLOCK_ROWS)])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def float_rows(self, numbers):
+        if self.full is not None:
+            return self.rows(numbers)
+        return np.asarray(self.vectors[list(numbers)], dtype=np.float32)
+
+    def rows(self, numbers):
+        # float32 rows of an int8 index
+        size = self.vectors.shape[1] * 4
+        data = b''.join(os.pread(self.full, size, int(number) * size) for number in numbers)
+        return np.frombuffer(data, dtype=np.float32).reshape(len(numbers), self.vectors.shape[1])
+
+    def search(self, embedding, k=4):
+        # [(chunk number, squared distance)], nearest first
+        if not len(self):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = self.norms - 2 * self.dot(query) + query @ query
+        if self.full is not None and self.rescore:
+            candidates = _smallest(distances, k * self.rescore)
+            # Rows in file order, so the reads go forward through the mapping
+            candidates.sort()
+            exact = self.norms[candidates] - 2 * (self.rows(candidates) @ query) + query @ query
+            best = _smallest(exact, k)
+            best = best[np.argsort(exact[best])]
+            return [(int(candidates[i]), float(exact[i])) for i in best]
+        best = _smallest(distances, k)
+        best = best[np.argsort(distances[best])]
+        return [(int(number), float(distances[number])) for number in best]
+
+    def text(self, number):
+        return self.texts[self.offsets[number]:self.offsets[number + 1]].decode('utf-8')
+
+    def document(self, number):
+        return Document(page_content=self.text(number), metadata=dict(self.metadatas[number]))
+
+
+def load_dense_index(persist_directory='.chroma'):
+    # None when there is no export, or when it was made from another version
+    # of the collection than the one in the manifest
+    path = dense_index_path(persist_directory)
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        return None
+    index = DenseIndex(path)
+    manifest = load_manifest(manifest_path(persist_directory)) or {}
+    if index.generation != manifest.get('generation'):
+        index.close()
+        return None
+    return index
+
+
+class DenseVectorStore(VectorStore):
+    # The read-only part of the Chroma store the chat uses (search, get by
+    # id, as_retriever), over a DenseIndex
+    def __init__(self, index, embedding):
+        self.index = index
+        self._embedding = embedding
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def close(self):
+        self.index.close()
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [self.index.document(number) for number, _ in self.index.search(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        embedding = self._embedding.embed_query(query)
+        return [(self.index.document(number), distance)
+                for number, distance in self.index.search(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    def get(self, ids=None, include=None, **kwargs):
+        if ids is None:
+            numbers = range(len(self.index))
+        else:
+            numbers = [self.index.numbers[chunk_id] for chunk_id in ids if chunk_id in self.index.numbers]
+        stored = {
+            'ids': [self.index.chunk_ids[number] for number in numbers],
+            'documents': [self.index.text(number) for number in numbers],
+            'metadatas': [dict(self.index.metadatas[number]) for number in numbers],
+        }
+        if include and 'embeddings' in include:
+            stored['embeddings'] = self.index.float_rows(numbers) if len(numbers) else []
+        return stored
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("The vector index is read-only; run 01_generate_embeddings.py")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("The vector index is built by 01_generate_embeddings.py")